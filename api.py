@@ -0,0 +1,98 @@
+# api.py
+
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from .config import API_BASE_BACK
+
+# (connect, read) timeouts in seconds for each phase of the scene workflow.
+TIMEOUTS = {
+    "generate_scene": (10, 1000),
+    "upload_media": (10, 300),
+    "status": (10, 30),
+}
+DEFAULT_TIMEOUT = (10, 60)
+
+# Idempotent calls are retried on connection errors, timeouts and these
+# statuses, sleeping a random time up to RETRY_BASE_DELAY * 2**attempt
+# (capped at RETRY_MAX_DELAY) between attempts.
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+RETRY_AFTER_MAX = 30.0
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+POOL_SIZE = 8
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the shared keep-alive session for the Cranky backend."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            # Retries are handled in request(), where they can be cancelled.
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def backoff_delay(attempt):
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def _retry_after(resp):
+    value = resp.headers.get("Retry-After")
+    try:
+        return min(float(value), RETRY_AFTER_MAX) if value else None
+    except ValueError:
+        return None
+
+
+def request(method, path, phase=None, idempotent=None, progress=None, **kwargs):
+    """Send ``method path`` to the backend through the pooled session.
+
+    ``phase`` selects the timeout from TIMEOUTS. Idempotent calls (by default
+    those with an idempotent HTTP method) are retried with jittered
+    exponential backoff; other calls are sent once. Between attempts the wait
+    goes through ``progress.wait`` when a progress is given, so it can be
+    cancelled. Returns the last response, or raises the last connection error.
+
+    A retried request resends its body as given, so a streamed ``data`` body
+    must be re-iterable (like MultipartFiles); file objects are not rewound.
+    """
+    method = method.upper()
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    attempts = RETRY_ATTEMPTS if idempotent else 1
+    kwargs.setdefault("timeout", TIMEOUTS.get(phase, DEFAULT_TIMEOUT))
+    url = path if path.startswith(("http://", "https://")) else f"{API_BASE_BACK}{path}"
+    session = get_session()
+
+    for attempt in range(attempts):
+        try:
+            resp = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"[Cranky] {method} {path} failed ({e}); retrying in {delay:.1f}s")
+        else:
+            if resp.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                return resp
+            delay = _retry_after(resp) or backoff_delay(attempt)
+            print(f"[Cranky] {method} {path} returned {resp.status_code}; retrying in {delay:.1f}s")
+            resp.close()
+        if progress:
+            progress.wait(delay)
+        else:
+            time.sleep(delay)
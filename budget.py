@@ -0,0 +1,70 @@
+# budget.py
+
+# Rough size model for the scene generation payload: about four UTF-8 bytes
+# per token holds for most prose and is cheap to compute.
+BYTES_PER_TOKEN = 4
+ELLIPSIS = " …"
+
+# Places a trimmed text may end, best first. A boundary is only used if it
+# keeps at least MIN_KEPT_FRACTION of the text that fits.
+TRIM_BOUNDARIES = ("\n\n", "\n", ". ", " ")
+MIN_KEPT_FRACTION = 0.6
+
+
+def estimate_tokens(text):
+    return (len(text.encode("utf-8")) + BYTES_PER_TOKEN - 1) // BYTES_PER_TOKEN
+
+
+def trim_to_tokens(text, max_tokens):
+    """Shorten ``text`` to an estimated ``max_tokens``, cutting at a paragraph, line, sentence or word boundary if possible."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    max_bytes = max(0, max_tokens * BYTES_PER_TOKEN - len(ELLIPSIS.encode("utf-8")))
+    cut = text.encode("utf-8")[:max_bytes].decode("utf-8", "ignore")
+    for sep in TRIM_BOUNDARIES:
+        pos = cut.rfind(sep)
+        if pos >= len(cut) * MIN_KEPT_FRACTION:
+            cut = cut[:pos + 1] if sep == ". " else cut[:pos]
+            break
+    return cut.rstrip() + ELLIPSIS
+
+
+def trim_card(front, back, max_tokens):
+    """Trim ``front`` and ``back`` to fit ``max_tokens`` together.
+
+    The front may use at most half of the budget unless the back needs less;
+    the back gets whatever the front leaves.
+    """
+    front_tokens = estimate_tokens(front)
+    back_tokens = estimate_tokens(back)
+    if front_tokens + back_tokens <= max_tokens:
+        return front, back
+    front = trim_to_tokens(front, max(max_tokens // 2, max_tokens - back_tokens))
+    back = trim_to_tokens(back, max_tokens - estimate_tokens(front))
+    return front, back
+
+
+class PayloadBudget:
+    """Splits a payload token budget over a known number of cards, in order.
+
+    Each card may use up to ``card_tokens``, but never more than an even share
+    of what is left, so the payload stays within ``max_tokens`` and what a
+    short card does not use is passed on to the cards after it.
+    """
+
+    def __init__(self, max_tokens, card_tokens, cards):
+        self.remaining = max_tokens
+        self.card_tokens = card_tokens
+        self.cards_left = cards
+        self.used = 0
+
+    def fit(self, front, back):
+        share = min(self.card_tokens, self.remaining // max(1, self.cards_left))
+        front, back = trim_card(front, back, share)
+        tokens = estimate_tokens(front) + estimate_tokens(back)
+        self.remaining -= tokens
+        self.used += tokens
+        self.cards_left -= 1
+        return front, back
@@ -1,229 +1,323 @@
-import json
 import os
-import re
+from anki.utils import ids2str
 from aqt import mw
-from PyQt6 import QtWidgets
-import sys
-import base64
-from .tag_input_widget import TagInputWidget  
-import random
-from heapq import nlargest
-import re
-import html as html_lib
-import struct
-import struct
-import os
-
-USE_MOCK_CARDS = False
+from .budget import PayloadBudget
+from .config import (
+    BATCH_CARDS_CACHE, CARD_TOKEN_BUDGET, CARDS_CACHE, MEDIA_BUDGET_BYTES, MEDIA_BUDGET_FILES,
+    NEAR_DUPLICATE_OVERSAMPLE, NEAR_DUPLICATE_THRESHOLD, PAYLOAD_TOKEN_BUDGET, TRANSCODE_IMAGES,
+)
+from .dedup import NearDuplicateFilter, signature
+from .fieldmap import get_field_mapping, save_field_mappings
+from .htmltext import field_text_cache_info, html_to_text
+from .media import MediaStore, extract_media_names, select_media_within_budget
+from .metrics import count, stage
+from .ndjson import NdjsonWriter, iter_ndjson
+from .notes import load_notes
+from .progress import ExportCancelled
+from .rendercache import cache_render, get_cached_render, save_render_cache
+from .selection import select_cards
 
 SCRATCHY_DIR = os.path.dirname(os.path.abspath(__file__))
 MEDIA_DIR = os.path.join(SCRATCHY_DIR, "viewer/media")
-OUTPUT_PATH = os.path.join(SCRATCHY_DIR, "cards_retrieved.json")
+OUTPUT_PATH = os.path.join(SCRATCHY_DIR, CARDS_CACHE)
 
 os.makedirs(MEDIA_DIR, exist_ok=True)
+media_store = MediaStore(MEDIA_DIR, transcode=TRANSCODE_IMAGES)
 
 print("cards.py loaded")
 
-def strip_clozes(text):
-    return re.sub(r'{{c\d+::(.*?)(::.*?)?}}', r'\1', text)
-
-
 def strip_html_tags_preserve_formatting(html):
+    return html_to_text(html, strip_clozes=False)
+
+
+def print_media_progress(done, total, filename, staged_name):
+    if staged_name:
+        print(f"✅ Staged media file {done}/{total}: {staged_name}")
+
+
+def render_note(note, model):
+    """Return front/back text and raw media names for a note, reusing the cached rendering when the note is unchanged."""
+    rendered = get_cached_render(note, model)
+    if rendered is not None:
+        return rendered
+    count("notes_rendered")
+
+    front_val, answer_vals, is_cloze = get_main_fields_for_note(note, model)
+    media_sources = set()
+    for val in note["fields"].values():
+        media_sources.update(extract_media_names(val))
+
+    rendered = {
+        "front": html_to_text(front_val),
+        "back": "\n\n".join(html_to_text(ans) for ans in answer_vals if ans.strip()),
+        "media": sorted(media_sources),
+        "front_media": sorted(set(extract_media_names(front_val))),
+    }
+    cache_render(note, model, rendered)
+    return rendered
+
+
+def collect_notes(note_ids, note_map, models, limit=None, progress=None):
+    """Render ``note_ids`` in rank order, skipping near-duplicates, until ``limit`` notes are kept.
+
+    Returns ``(notes, media_refs)``, where ``media_refs`` maps each media name
+    the kept notes use to whether a question field references it.
+    """
+    notes = [note_map[nid] for nid in note_ids if nid in note_map]
+    target = len(notes) if limit is None else min(limit, len(notes))
+    duplicates = NearDuplicateFilter(NEAR_DUPLICATE_THRESHOLD)
+    selected = []
+    media_refs = {}
+    for note in notes:
+        if len(selected) >= target:
+            break
+        if progress:
+            progress.update("Rendering notes...", len(selected), target)
+        rendered = render_note(note, models[note["mid"]])
+        # Media names take part so image-only notes are told apart.
+        sig = signature((rendered["front"], rendered["back"]), rendered["media"])
+        duplicate_of = duplicates.add(note["id"], sig)
+        if duplicate_of is not None:
+            print(f"[Cranky] Skipping note {note['id']}, a near-duplicate of {duplicate_of}")
+            count("near_duplicates_skipped")
+            continue
+        selected.append(note)
+        front_media = set(rendered["front_media"])
+        for name in rendered["media"]:
+            media_refs[name] = media_refs.get(name, False) or name in front_media
+    return selected, media_refs
+
+
+def write_payload(path, notes, models, staged, chosen, progress=None):
+    """Write ``notes`` to ``path`` as NDJSON records within the token budget; returns the number written.
+
+    ``staged`` maps media names to stored names; only the names in
+    ``chosen``, this payload's media budget, are listed with the notes.
+    """
+    budget = PayloadBudget(PAYLOAD_TOKEN_BUDGET, CARD_TOKEN_BUDGET, len(notes))
+    with NdjsonWriter(path) as writer:
+        for note in notes:
+            if progress:
+                progress.check()
+            rendered = render_note(note, models[note["mid"]])
+            front, back = budget.fit(rendered["front"], rendered["back"])
+            if front != rendered["front"] or back != rendered["back"]:
+                count("cards_trimmed")
+            writer.write({
+                "uid": str(note["id"]),
+                "front": front,
+                "back": back,
+                "images": [staged[name] for name in rendered["media"] if name in chosen and name in staged],
+            })
+    count("payload_tokens_estimated", budget.used)
+    return writer.count
+
+
+def export_note_sets(note_id_sets, paths, progress=None, limit=None):
+    """Export each list in ``note_id_sets`` to the matching path and return the number written to each.
+
+    Notes are loaded in one query and media is staged once for all sets.
+    Within a set, ``note_ids`` is in rank order: near-duplicates of a
+    higher-ranked note are skipped and at most ``limit`` notes are exported.
+    Each set gets its own media budget, and its payload lists only the
+    media that budget chose, even where another set included more.
+
+    ``progress`` is an optional ExportProgress that receives stage updates and
+    is checked once per note and media file, so a cancelled export stops early.
+    """
+    field_cache_start = field_text_cache_info()
+    if progress:
+        progress.update("Loading notes...")
+    with stage("note_loading"):
+        all_ids = list(dict.fromkeys(nid for note_ids in note_id_sets for nid in note_ids))
+        note_map, models = load_notes(all_ids)
+
+    # Media is budgeted and staged up front so each record can be written as
+    # soon as it is rendered; re-rendering below is a render cache hit.
+    with stage("render"):
+        collected = [collect_notes(note_ids, note_map, models, limit, progress) for note_ids in note_id_sets]
+    media_dir = mw.col.media.dir()
+
+    def on_media_progress(done, total, filename, staged_name):
+        print_media_progress(done, total, filename, staged_name)
+        if progress:
+            progress.update("Staging media...", done, total)
+
+    with stage("media_budget"):
+        chosen_sets = [
+            select_media_within_budget(media_refs, media_dir, MEDIA_BUDGET_BYTES, MEDIA_BUDGET_FILES)
+            for _, media_refs in collected
+        ]
+    with stage("media_staging"):
+        # Each file is staged once, however many sets chose it.
+        included = sorted(set().union(*chosen_sets))
+        staged = media_store.stage(included, media_dir, on_progress=on_media_progress)
+
+    if progress:
+        progress.update("Writing export...")
+    with stage("write"):
+        written = [
+            write_payload(path, notes, models, staged, chosen, progress)
+            for path, (notes, _), chosen in zip(paths, collected, chosen_sets)
+        ]
+
+    save_field_mappings()
+    save_render_cache()
+    count("notes_exported", sum(written))
+    field_cache_end = field_text_cache_info()
+    count("field_text_cache_hits", field_cache_end["hits"] - field_cache_start["hits"])
+    count("field_text_cache_misses", field_cache_end["misses"] - field_cache_start["misses"])
+    return written
+
+
+def export_notes(note_ids, progress=None, limit=None):
+    """Export ``note_ids`` to OUTPUT_PATH, one NDJSON record per note, and return the number written."""
+    return export_note_sets([note_ids], [OUTPUT_PATH], progress, limit)[0]
+
+
+def batch_output_path(index):
+    return os.path.join(SCRATCHY_DIR, BATCH_CARDS_CACHE.format(index))
+
+
+def build_search_query(deck, tags):
+    query_parts = []
+    if deck and deck != "all" and deck != "-none-":
+        query_parts.append(f'deck:"{deck}"')
+    for tag in tags:
+        query_parts.append(f'tag:"{tag}"')
+    # No is:review or is:new for these modes!
+    return " ".join(query_parts)
+
+
+def estimate_payload_tokens(deck, tags, selection_mode, limit=25):
+    """Estimate the generate_scene payload size, in tokens, for a selection.
+
+    Ranks and renders like fetch_cards_by_criteria and applies the same text
+    budget, but skips near-duplicate collapsing, media and writing, so it is
+    cheap enough to run while the selection is being edited.
+    """
+    card_ids = mw.col.find_cards(build_search_query(deck, tags))
+    note_ids = [nid for _, nid in select_cards(card_ids, selection_mode, limit)]
+    note_map, models = load_notes(note_ids)
+    notes = [note_map[nid] for nid in note_ids if nid in note_map]
+    budget = PayloadBudget(PAYLOAD_TOKEN_BUDGET, CARD_TOKEN_BUDGET, len(notes))
+    for note in notes:
+        rendered = render_note(note, models[note["mid"]])
+        budget.fit(rendered["front"], rendered["back"])
+    return budget.used
+
+
+def fetch_cards_by_criteria(deck, tags, selection_mode, limit=25, progress=None):
+    """Select and export cards, returning the number exported (0 on failure).
+
+    Raises ExportCancelled if ``progress`` is cancelled along the way.
+    """
+    try:
+        query = build_search_query(deck, tags)
+        if progress:
+            progress.update("Finding cards...")
+        with stage("find_cards"):
+            card_ids = mw.col.find_cards(query)
+        count("cards_scanned", len(card_ids))
 
-    html = re.sub(r'<style.*?>.*?</style>', '', html, flags=re.DOTALL | re.IGNORECASE)
-    html = re.sub(r'<script.*?>.*?</script>', '', html, flags=re.DOTALL | re.IGNORECASE)   
-    html = re.sub(r'</li\s*>', '\n', html, flags=re.IGNORECASE)
-    html = re.sub(r'<li\s*>', '• ', html, flags=re.IGNORECASE)
-    html = re.sub(r'<(ul|ol).*?>', '\n', html, flags=re.IGNORECASE)
-    html = re.sub(r'</(ul|ol)>', '\n', html, flags=re.IGNORECASE)   
-    html = re.sub(r'<br\s*/?>', '\n', html, flags=re.IGNORECASE)
-    html = re.sub(r'</?div.*?>', '\n', html, flags=re.IGNORECASE)  
-    html = re.sub(r'<.*?>', '', html)
+        if not card_ids:
+            print("No cards found")
+            return 0
 
-    text = html_lib.unescape(html)
-    text = re.sub(r'\n{3,}', '\n\n', text)
+        if progress:
+            progress.update(f"Ranking {len(card_ids)} cards...")
+        with stage("ranking"):
+            ranked = select_cards(card_ids, selection_mode, limit * NEAR_DUPLICATE_OVERSAMPLE, progress)
+        note_ids = [nid for _, nid in ranked]
+        return export_notes(note_ids, progress, limit=limit)
 
-    return text.strip()
+    except ExportCancelled:
+        raise
+    except Exception as e:
+        print(f"[Cranky] Export failed: {e}")
+        return 0
 
 
-def extract_media_names(html):
-    return re.findall(r'src="([^"]+)"', html) + re.findall(r'\[sound:([^\]]+)\]', html)
+def scope_matcher(deck, tags):
+    """Return ``matches(did, odid, note_tags)`` for the cards build_search_query(deck, tags) finds.
 
-def sanitize_filename_base64(filename):
-    name, ext = os.path.splitext(filename)
-    encoded = base64.urlsafe_b64encode(name.encode()).decode().rstrip("=")
-    return f"{encoded}{ext}"
+    Decks match with their subdecks (cards in filtered decks by their home
+    deck) and tags with their child tags, case-insensitively. Names are
+    compared literally, without search wildcards.
+    """
+    deck_ids = None
+    if deck and deck != "all" and deck != "-none-":
+        did = mw.col.decks.id_for_name(deck)
+        deck_ids = set(mw.col.decks.deck_and_child_ids(did)) if did else set()
+    wanted = [tag.lower() for tag in tags]
 
-def download_media_file(filename):
-    try:
-        media_path = mw.col.media.dir()
-        abs_path = os.path.join(media_path, filename)
-        if os.path.exists(abs_path):
-            safe_name = sanitize_filename_base64(filename)
-            dest_path = os.path.join(MEDIA_DIR, safe_name)
-            with open(abs_path, "rb") as src, open(dest_path, "wb") as dst:
-                dst.write(src.read())
-            print(f"✅ Copied media file: {safe_name}")
-            return safe_name
+    def matches(did, odid, note_tags):
+        if deck_ids is not None and did not in deck_ids and odid not in deck_ids:
+            return False
+        have = note_tags.lower().split()
+        return all(any(t == w or t.startswith(w + "::") for t in have) for w in wanted)
 
-    except Exception as e:
-        print(f"⚠️ Could not download media {filename}: {e}")
-    return None
+    return matches
 
 
-def fetch_cards_by_criteria(deck, tags, selection_mode, limit=25):
-    try:
-      
-        # Build query
-        query_parts = []
-        if deck and deck != "all" and deck != "-none-":
-            query_parts.append(f'deck:"{deck}"')
-        for tag in tags:
-            query_parts.append(f'tag:"{tag}"')
-        # No is:review or is:new for these modes!
-        query = " ".join(query_parts)
-        card_ids = mw.col.find_cards(query)
+def fetch_cards_for_scopes(scopes, selection_mode, limit=25, progress=None):
+    """Export one payload per ``(deck, tags)`` scope to batch_output_path(i).
 
+    All scopes are searched with one combined query whose results are
+    partitioned per scope; notes are loaded and media is staged once for all
+    of them. Returns the number of notes exported for each scope (all 0 on
+    failure). Raises ExportCancelled if ``progress`` is cancelled.
+    """
+    try:
+        queries = [build_search_query(deck, tags) for deck, tags in scopes]
+        # An empty scope query matches everything, and so does the union.
+        combined = "" if not all(queries) else " or ".join(f"({q})" for q in queries)
+        if progress:
+            progress.update("Finding cards...")
+        with stage("find_cards"):
+            card_ids = mw.col.find_cards(combined)
+        count("cards_scanned", len(card_ids))
         if not card_ids:
             print("No cards found")
-            return []
-
-        def fetch_top_cards(card_ids, key):
-            best_cards_by_note = {}
-            for cid in card_ids:
-                card = mw.col.get_card(cid)
-                note_id = card.nid
-                val = getattr(card, key, 0)
-                if note_id not in best_cards_by_note or val > getattr(best_cards_by_note[note_id], key, 0):
-                    best_cards_by_note[note_id] = card
-            from heapq import nlargest
-            return nlargest(limit, best_cards_by_note.values(), key=lambda c: getattr(c, key, 0))
-
-        if selection_mode == "Random":
-            import random
-            chosen_ids = random.sample(card_ids, min(limit, len(card_ids)))
-            top_cards = [mw.col.get_card(cid) for cid in chosen_ids]
-        elif selection_mode == "Most Repetitions":
-            top_cards = fetch_top_cards(card_ids, "reps")
-        else:  # Most Lapses
-            top_cards = fetch_top_cards(card_ids, "lapses")
-
-
-        def fetch_top_cards(card_ids, key):
-            best_cards_by_note = {}
-            batch_size = 500
-            for i in range(0, len(card_ids), batch_size):
-                batch = card_ids[i:i + batch_size]
-                for cid in batch:
-                    card = mw.col.get_card(cid)
-                    note_id = card.nid
-                    val = getattr(card, key, 0)
-                    if note_id not in best_cards_by_note or val > getattr(best_cards_by_note[note_id], key, 0):
-                        best_cards_by_note[note_id] = card
-            return nlargest(25, best_cards_by_note.values(), key=lambda c: getattr(c, key, 0))
-
-
-        if selection_mode == "Random":
-            random_ids = random.sample(card_ids, min(25, len(card_ids)))
-            top_cards = [mw.col.get_card(cid) for cid in random_ids]
-        elif selection_mode == "Most Repetitions":
-            top_cards = fetch_top_cards(card_ids, "reps")
-        else:  # Most Lapses
-            top_cards = fetch_top_cards(card_ids, "lapses")
-
-
-        note_ids = [c.nid for c in top_cards]
-        notes = [mw.col.get_note(nid) for nid in note_ids]
-        note_map = {n.id: n for n in notes}
-
-        selected = []
-        model_templates_cache = {}
-
-        for c in top_cards:
-            nid = c.nid
-            note = note_map.get(nid)
-            if not note:
-                continue
-
-            # Get main fields
-            front_val, answer_vals, is_cloze = get_main_fields_for_note(note, model_templates_cache)
-            # Clean up
-            front = strip_html_tags_preserve_formatting(strip_clozes(front_val))
-            back = "\n\n".join(strip_html_tags_preserve_formatting(strip_clozes(ans)) for ans in answer_vals if ans.strip())
-
-            flds = dict(note.items())  # Now {fieldname: value}
-            media_sources = set()
-            for val in flds.values():
-                media_sources.update(extract_media_names(val))
-
-            downloaded = []
-            for filename in media_sources:
-                path = download_media_file(filename)
-                if not path:
-                    continue
-                full_path = os.path.join(MEDIA_DIR, path)
-                ext = os.path.splitext(path)[1].lower()
-                if ext in ('.png', '.jpg', '.jpeg', '.gif','.webp'):
-                    try:                  
-                        downloaded.append(path)
-                    except Exception as e:
-                        print(f"⚠️ Could not download image: {path} ({e})")
-                else:
-                    downloaded.append(path)  # Always include non-image files (SVG, audio, etc.)
-
-            selected.append({
-                "uid": str(nid),
-                "front": front,
-                "back": back,
-                "images": downloaded
-            })
+            return [0] * len(scopes)
+
+        matchers = [scope_matcher(deck, tags) for deck, tags in scopes]
+        scope_cards = [[] for _ in scopes]
+        with stage("partition"):
+            rows = mw.col.db.all(
+                f"select c.id, c.did, c.odid, n.tags from cards c join notes n on n.id = c.nid "
+                f"where c.id in {ids2str(card_ids)}"
+            )
+            for cid, did, odid, note_tags in rows:
+                for matches, cids in zip(matchers, scope_cards):
+                    if matches(did, odid, note_tags):
+                        cids.append(cid)
+
+        note_id_sets = []
+        with stage("ranking"):
+            for i, cids in enumerate(scope_cards):
+                if progress:
+                    progress.update(f"Ranking cards for {scopes[i][0]}...", i, len(scopes))
+                ranked = select_cards(cids, selection_mode, limit * NEAR_DUPLICATE_OVERSAMPLE, progress)
+                note_id_sets.append([nid for _, nid in ranked])
+        paths = [batch_output_path(i) for i in range(len(scopes))]
+        return export_note_sets(note_id_sets, paths, progress, limit=limit)
+
+    except ExportCancelled:
+        raise
+    except Exception as e:
+        print(f"[Cranky] Batch export failed: {e}")
+        return [0] * len(scopes)
 
-        with open(OUTPUT_PATH, "w") as f:
-            json.dump(selected, f, indent=2, ensure_ascii=False)
-        return selected
 
-    except Exception as e:
-        return []
-
-
-def get_main_fields_for_note(note, model_templates_cache):
-    flds = dict(note.items())
-    model_id = note.mid
-    model = mw.col.models.get(model_id)
-    model_name = model['name']
-
-    if model_name not in model_templates_cache:
-        templates = model['tmpls']
-        if not templates:
-            return "", [], False
-        first_template = templates[0]
-        t_front = first_template['qfmt']
-        t_back = first_template['afmt']
-        # Detect cloze: look for {{cloze:...}} in front template
-        cloze_match = re.search(r"{{.*cloze:([\w-]+)\s*}}", t_front, re.IGNORECASE)
-        if cloze_match:
-            model_templates_cache[model_name] = {
-                "is_cloze": True,
-                "cloze_field": cloze_match.group(1),
-                "t_back": t_back,
-            }
-        else:
-            field_re = re.compile(r"{{\s*([\w-]+)\s*}}", re.IGNORECASE)
-            front_fields = set(field_re.findall(t_front))
-            back_fields = [f for f in field_re.findall(t_back) if f not in front_fields]
-            q_field = next(iter(front_fields), None)
-            model_templates_cache[model_name] = {
-                "is_cloze": False,
-                "t_front": t_front,
-                "t_back": t_back,
-                "question_field": q_field,
-                "answer_fields": back_fields,
-            }
-    info = model_templates_cache[model_name]
+def get_main_fields_for_note(note, model):
+    flds = note["fields"]
+    info = get_field_mapping(model)
+    if info is None:
+        return "", [], False
 
     if info.get("is_cloze"):
         cloze_field = info["cloze_field"]
-        t_back = info["t_back"]
         question = flds.get(cloze_field, "")
         answer = question
         extra_field = None
@@ -243,8 +337,6 @@ def get_main_fields_for_note(note, model_templates_cache):
                     answer += "\n\n" + candidates[most_content_field]
         return question, [answer], True
     else:
-        t_front = info["t_front"]
-        t_back = info["t_back"]
         q_field = info.get("question_field")
         answer_fields = info.get("answer_fields", [])
         q_val = flds.get(q_field, "") if q_field else ""
@@ -252,37 +344,18 @@ def get_main_fields_for_note(note, model_templates_cache):
         return q_val, a_vals, False
 
 
-def get_cards(force_refresh=False):
-    if not force_refresh and os.path.exists(OUTPUT_PATH):
-        with open(OUTPUT_PATH, "r") as f:
-            return json.load(f)
+def iter_cards():
+    """Lazily yield the records of the last export."""
+    return iter_ndjson(OUTPUT_PATH)
 
-    cards = MOCK_CARDS if USE_MOCK_CARDS else fetch_cards()
 
-    if cards:
-        with open(OUTPUT_PATH, "w") as f:
-            json.dump(cards, f, indent=2, ensure_ascii=False)
-    return cards
-
-
-    # Use cached info
-    info = model_templates_cache[model_name]
-    if info.get("is_cloze"):
-        main = info["cloze_field"]
-        answer_fields = [main]
-        # find a secondary answer (e.g. Extra)
-        field_re = re.compile(r"{{\s*([\w-]+)\s*}}", re.IGNORECASE)
-        back_fields = field_re.findall(info["t_back"])
-        for f in back_fields:
-            if f.lower() != main.lower() and f in flds:
-                answer_fields.append(f)
-                break  # just one extra
-        q_val = flds.get(main, {}).get("value", "")
-        a_vals = [flds.get(f, {}).get("value", "") for f in answer_fields if f in flds]
-        return q_val, a_vals, True
-    else:
-        q_field = info["question_field"]
-        answer_fields = info["answer_fields"]
-        q_val = flds.get(q_field, {}).get("value", "") if q_field else ""
-        a_vals = [flds.get(f, {}).get("value", "") for f in answer_fields if f in flds]
-        return q_val, a_vals, False
+def get_cards(force_refresh=False):
+    """Return the last export as a list.
+
+    With ``force_refresh`` the exported notes are reloaded and re-exported;
+    only notes (or note types) modified since their last rendering are
+    rendered again.
+    """
+    if force_refresh:
+        export_notes([int(card["uid"]) for card in iter_cards()])
+    return list(iter_cards())
@@ -7,4 +7,36 @@ VIEWER_DIR = os.path.join(ADDON_DIR, "viewer")
 
 API_BASE_BACK = "https://api.cranky.app"
 API_BASE_FRONT = "https://cranky.app"
-CARDS_CACHE = "cards_retrieved.json"
+CARDS_CACHE = "cards_retrieved.ndjson"
+BATCH_CARDS_CACHE = "cards_batch_{}.ndjson"
+FIELD_MAP_CACHE = "field_map_cache.json"
+RENDER_CACHE = "render_cache"
+EXPORT_REPORT = "export_report.json"
+
+# Downscale and re-encode large images before upload.
+TRANSCODE_IMAGES = True
+TRANSCODE_MAX_DIMENSION = 1600
+
+# Per-export media budget; lower-priority files beyond it are left out.
+MEDIA_BUDGET_BYTES = 50 * 1024 * 1024
+MEDIA_BUDGET_FILES = 100
+
+# Days of review history used by the review-log selection modes.
+REVLOG_WINDOW_DAYS = 30
+
+# Notes whose front/back text is at least this similar (estimated Jaccard over
+# character shingles) are collapsed into the higher-ranked one. Selection
+# over-fetches by NEAR_DUPLICATE_OVERSAMPLE so collapsed notes can be replaced.
+NEAR_DUPLICATE_THRESHOLD = 0.8
+NEAR_DUPLICATE_OVERSAMPLE = 4
+
+# Payload size limits for generate_scene, in estimated tokens (about four bytes
+# each). Over-long card text is trimmed to fit. Each card gets an even share of
+# what is left of the payload budget, which for a full 25-card export starts at
+# 480 tokens. That share is usually the limit; CARD_TOKEN_BUDGET only caps a
+# card once shorter cards before it have left their share unused.
+CARD_TOKEN_BUDGET = 600
+PAYLOAD_TOKEN_BUDGET = 12000
+
+# Number of converted field texts kept in memory for reuse within a session.
+FIELD_TEXT_CACHE_SIZE = 4096
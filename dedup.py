@@ -0,0 +1,104 @@
+# dedup.py
+
+import re
+
+# One-permutation MinHash: every shingle is hashed once and falls into one of
+# NUM_BINS bins by its low bits, each bin keeping its minimum. Bins are grouped
+# into bands of BAND_ROWS for locality-sensitive lookup.
+BIN_BITS = 5
+NUM_BINS = 1 << BIN_BITS
+_BIN_MASK = NUM_BINS - 1
+# Above any str hash; marks a bin no shingle fell into.
+_EMPTY_BIN = 1 << 64
+BAND_ROWS = 4
+SHINGLE_SIZE = 5
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def _normalise(text):
+    return _NON_WORD_RE.sub(" ", text.lower()).strip()
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Return the set of character ``size``-grams of ``text`` after normalising case, punctuation and spacing."""
+    text = _normalise(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _shingle_hashes(text, size=SHINGLE_SIZE):
+    # The hashes of shingles(text), computed without building the strings'
+    # set or looping in Python.
+    text = _normalise(text)
+    n = len(text)
+    if n <= size:
+        return (hash(text),) if text else ()
+    return map(hash, map(text.__getitem__, map(slice, range(n - size + 1), range(size, n + 1))))
+
+
+def signature(texts, tokens=()):
+    """Return the MinHash signature of the shingles of all ``texts`` plus the literal ``tokens``.
+
+    Texts are pooled, so a note with front and back swapped gets the same
+    signature. Bins no shingle fell into are None. Uses the built-in string
+    hash, so signatures are only comparable within one process.
+    """
+    hashes = set(map(hash, tokens))
+    for text in texts:
+        hashes.update(_shingle_hashes(text))
+    # One pass over the hashes, each compared only with its bin's minimum.
+    mins = [_EMPTY_BIN] * NUM_BINS
+    for h in hashes:
+        b = h & _BIN_MASK
+        if h < mins[b]:
+            mins[b] = h
+    return [None if h == _EMPTY_BIN else h for h in mins]
+
+
+def similarity(sig_a, sig_b):
+    """Estimate the Jaccard similarity of the shingle sets behind two signatures."""
+    used = matched = 0
+    for a, b in zip(sig_a, sig_b):
+        if a is None and b is None:
+            continue
+        used += 1
+        matched += a == b
+    return matched / used if used else 0.0
+
+
+class NearDuplicateFilter:
+    """Greedy near-duplicate filter: the first of a group of similar items is kept.
+
+    Kept signatures are indexed by band, so checking a new item only compares
+    it against kept items that agree with it on at least one whole band.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self._kept = {}     # key -> signature
+        self._buckets = {}  # (band start, band values) -> [keys]
+
+    @staticmethod
+    def _band_keys(sig):
+        for start in range(0, NUM_BINS, BAND_ROWS):
+            band = tuple(sig[start:start + BAND_ROWS])
+            if any(v is not None for v in band):
+                yield start, band
+
+    def add(self, key, sig):
+        """Keep ``key`` unless it is a near-duplicate; return the key it duplicates, or None."""
+        band_keys = list(self._band_keys(sig))
+        seen = set()
+        for band_key in band_keys:
+            for other in self._buckets.get(band_key, ()):
+                if other in seen:
+                    continue
+                seen.add(other)
+                if similarity(sig, self._kept[other]) >= self.threshold:
+                    return other
+        self._kept[key] = sig
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, []).append(key)
+        return None
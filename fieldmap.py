@@ -0,0 +1,66 @@
+# fieldmap.py
+
+import os
+import re
+from .config import ADDON_DIR, FIELD_MAP_CACHE
+from .utils import atomic_write_json, load_json_cache
+
+FIELD_MAP_PATH = os.path.join(ADDON_DIR, FIELD_MAP_CACHE)
+
+_CLOZE_RE = re.compile(r"{{.*cloze:([\w-]+)\s*}}", re.IGNORECASE)
+_FIELD_RE = re.compile(r"{{\s*([\w-]+)\s*}}", re.IGNORECASE)
+
+# str(note type id) -> {"mod": note type mod, "info": parsed mapping or None}.
+# Loaded lazily from FIELD_MAP_PATH and kept for the rest of the session.
+_mappings = None
+_dirty = False
+
+
+def _load_mappings():
+    global _mappings
+    if _mappings is None:
+        _mappings = load_json_cache(FIELD_MAP_PATH, "field map cache") or {}
+    return _mappings
+
+
+def parse_field_mapping(model):
+    """Work out which fields form the question and answer of a note type from its first template."""
+    templates = model["tmpls"]
+    if not templates:
+        return None
+    t_front = templates[0]["qfmt"]
+    t_back = templates[0]["afmt"]
+
+    cloze_match = _CLOZE_RE.search(t_front)
+    if cloze_match:
+        return {"is_cloze": True, "cloze_field": cloze_match.group(1)}
+
+    # First field in template order, so the choice is stable across runs.
+    front_fields = list(dict.fromkeys(_FIELD_RE.findall(t_front)))
+    back_fields = [f for f in _FIELD_RE.findall(t_back) if f not in front_fields]
+    return {
+        "is_cloze": False,
+        "question_field": front_fields[0] if front_fields else None,
+        "answer_fields": back_fields,
+    }
+
+
+def get_field_mapping(model):
+    """Return the cached field mapping for ``model``, re-parsing it only when the note type changed."""
+    global _dirty
+    mappings = _load_mappings()
+    key = str(model["id"])
+    entry = mappings.get(key)
+    if entry is None or entry.get("mod") != model["mod"]:
+        entry = {"mod": model["mod"], "info": parse_field_mapping(model)}
+        mappings[key] = entry
+        _dirty = True
+    return entry["info"]
+
+
+def save_field_mappings():
+    global _dirty
+    if not _dirty:
+        return
+    if atomic_write_json(FIELD_MAP_PATH, _mappings, "field map cache"):
+        _dirty = False
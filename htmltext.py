@@ -0,0 +1,116 @@
+# htmltext.py
+
+import hashlib
+import html as html_lib
+import re
+import threading
+from collections import OrderedDict
+from .config import FIELD_TEXT_CACHE_SIZE
+
+_CLOZE_RE = re.compile(r"{{c\d+::(.*?)(::.*?)?}}")
+
+# The conversion rules, applied in order to the whole field. Each rule can
+# only match if one of its trigger strings occurs in the lower-cased field,
+# so rules for markup a field does not contain are skipped with a substring
+# test instead of a regex scan. Most fields use two or three of them.
+_BLOCK_RULES = (
+    (("<style",), re.compile(r"<style.*?>.*?</style>", re.DOTALL | re.IGNORECASE), ""),
+    (("<script",), re.compile(r"<script.*?>.*?</script>", re.DOTALL | re.IGNORECASE), ""),
+)
+_LAYOUT_RULES = (
+    (("</li",), re.compile(r"</li\s*>", re.IGNORECASE), "\n"),
+    (("<li",), re.compile(r"<li\s*>", re.IGNORECASE), "• "),
+    (("<ul", "<ol"), re.compile(r"<(?:ul|ol)[^>\n]*>", re.IGNORECASE), "\n"),
+    (("</ul", "</ol"), re.compile(r"</(?:ul|ol)>", re.IGNORECASE), "\n"),
+    (("<br",), re.compile(r"<br\s*/?>", re.IGNORECASE), "\n"),
+    (("<div", "</div"), re.compile(r"</?div[^>\n]*>", re.IGNORECASE), "\n"),
+)
+_TAG_RE = re.compile(r"<[^>\n]*>")
+_EXTRA_NEWLINES_RE = re.compile(r"\n{3,}")
+
+# Letters re.IGNORECASE matches that str.lower() does not map to ASCII.
+_CASE_SPECIALS = str.maketrans({"\u0130": "i", "\u0131": "i", "\u017f": "s", "\u212a": "k"})
+_CASE_SPECIALS_RE = re.compile("[\u0130\u0131\u017f\u212a]")
+
+# Converted text by (digest of the field HTML, strip_clozes), least recently
+# used first, up to FIELD_TEXT_CACHE_SIZE entries. Shared boilerplate such as
+# "Extra" fields or template text is converted once per session. Keys are
+# digests so large fields are not kept alive twice.
+_field_text_cache = OrderedDict()
+_field_text_lock = threading.Lock()
+_field_text_hits = 0
+_field_text_misses = 0
+
+
+def html_to_text(html, strip_clozes=True):
+    """Convert field HTML to plain text.
+
+    Cloze markup is reduced to its answer, style/script blocks are dropped,
+    list, break and div tags become text layout, other tags are removed and
+    entities are unescaped. Runs of more than two newlines are collapsed.
+    Results are cached by content; see field_text_cache_info().
+    """
+    global _field_text_hits, _field_text_misses
+    if not html:
+        return ""
+
+    key = (hashlib.blake2b(html.encode("utf-8"), digest_size=16).digest(), strip_clozes)
+    with _field_text_lock:
+        text = _field_text_cache.get(key)
+        if text is not None:
+            _field_text_cache.move_to_end(key)
+            _field_text_hits += 1
+            return text
+        _field_text_misses += 1
+
+    text = _convert(html, strip_clozes)
+    with _field_text_lock:
+        _field_text_cache[key] = text
+        if len(_field_text_cache) > FIELD_TEXT_CACHE_SIZE:
+            _field_text_cache.popitem(last=False)
+    return text
+
+
+def field_text_cache_info():
+    """Return hit/miss counters and the current size of the html_to_text cache."""
+    with _field_text_lock:
+        return {
+            "hits": _field_text_hits,
+            "misses": _field_text_misses,
+            "size": len(_field_text_cache),
+            "max_size": FIELD_TEXT_CACHE_SIZE,
+        }
+
+
+def _fold_case(html):
+    if not html.isascii() and _CASE_SPECIALS_RE.search(html):
+        html = html.translate(_CASE_SPECIALS)
+    return html.lower()
+
+
+def _has_trigger(folded, triggers):
+    return any(trigger in folded for trigger in triggers)
+
+
+def _convert(html, strip_clozes):
+    if strip_clozes and "{{c" in html:
+        html = _CLOZE_RE.sub(r"\1", html)
+    if "<" in html:
+        folded = _fold_case(html)
+        for triggers, pattern, replacement in _BLOCK_RULES:
+            if _has_trigger(folded, triggers):
+                stripped = pattern.sub(replacement, html)
+                # Removing a block can join text into new tags.
+                if stripped != html:
+                    html = stripped
+                    folded = _fold_case(html)
+        # Layout rules insert only newlines and bullets, which cannot
+        # complete a trigger, so the folded text stays usable.
+        for triggers, pattern, replacement in _LAYOUT_RULES:
+            if _has_trigger(folded, triggers):
+                html = pattern.sub(replacement, html)
+        html = _TAG_RE.sub("", html)
+    text = html_lib.unescape(html) if "&" in html else html
+    if "\n\n\n" in text:
+        text = _EXTRA_NEWLINES_RE.sub("\n\n", text)
+    return text.strip()
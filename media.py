@@ -0,0 +1,358 @@
+# media.py
+
+import hashlib
+import html as html_lib
+import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .config import TRANSCODE_MAX_DIMENSION
+from .metrics import count
+from .transcode import TRANSCODABLE_EXTS, transcode_image
+from .utils import atomic_write_json, load_json_cache
+
+MAX_STAGING_WORKERS = 4
+MEDIA_STORE_MAX_BYTES = 512 * 1024 * 1024
+MEDIA_INDEX_NAME = "index.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+# Every way a field can point at collection media, in one pattern: src and
+# data-src (double, single or unquoted), srcset, CSS url(...) and [sound:...].
+_MEDIA_REF_RE = re.compile(
+    r"""\b(?:data-)?src\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>"']+))"""
+    r"""|\bsrcset\s*=\s*(?:"([^"]*)"|'([^']*)')"""
+    r"""|\burl\(\s*(?:"([^"]*)"|'([^']*)'|([^)"'\s]*))\s*\)"""
+    r"""|\[sound:([^\]]+)\]""",
+    re.IGNORECASE,
+)
+_SRCSET_GROUPS = (4, 5)
+# "https:", "data:", "file:" ... but not a bare Windows drive letter.
+_URL_SCHEME_RE = re.compile(r"[a-zA-Z][a-zA-Z0-9+.-]+:")
+
+# media dir -> (directory mtime, set of file names, {folded name: file name})
+_dir_listings = {}
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg", ".bmp", ".tif", ".tiff")
+
+
+def extract_media_names(html):
+    """Return the media file names referenced by a field, deduplicated, in order of appearance."""
+    names = {}
+    for m in _MEDIA_REF_RE.finditer(html):
+        index = m.lastindex
+        value = m.group(index)
+        if index in _SRCSET_GROUPS:
+            candidates = (part.split()[0] for part in value.split(",") if part.strip())
+        else:
+            candidates = (value,)
+        for name in candidates:
+            name = html_lib.unescape(name).strip()
+            # url(&quot;x.png&quot;) keeps its quotes through the pattern.
+            if len(name) >= 2 and name[0] == name[-1] and name[0] in "\"'":
+                name = name[1:-1].strip()
+            if name:
+                names[name] = None
+    return list(names)
+
+
+def _fold_name(name):
+    return unicodedata.normalize("NFC", name).casefold()
+
+
+def _dir_listing(media_dir):
+    # Re-list only when the directory changed.
+    mtime = os.stat(media_dir).st_mtime_ns
+    cached = _dir_listings.get(media_dir)
+    if cached is None or cached[0] != mtime:
+        names = frozenset(os.listdir(media_dir))
+        cached = (mtime, names, {_fold_name(n): n for n in names})
+        _dir_listings[media_dir] = cached
+    return cached
+
+
+def resolve_media_name(media_dir, name):
+    """Return the name under which ``name`` exists in ``media_dir``, or None.
+
+    Collection media is flat, so only plain file names are looked up; paths,
+    ".." and URLs (``https://``, ``data:``) are rejected without touching the
+    disk. Field references do not always match the file name byte for byte:
+    macOS stores names decomposed (NFD) and case-insensitive filesystems
+    accept any case. A reference that is not listed as is is matched
+    ignoring case and Unicode normalisation.
+    """
+    if not name or name in (".", "..") or "/" in name or "\\" in name or _URL_SCHEME_RE.match(name):
+        return None
+    _, names, folded = _dir_listing(media_dir)
+    if name in names:
+        return name
+    return folded.get(_fold_name(name))
+
+
+def _kernel_copy(src_path, dest_path):
+    # copy_file_range lets the kernel (or a reflink-capable filesystem) copy
+    # without the data passing through Python.
+    with open(src_path, "rb") as src, open(dest_path, "wb") as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+
+
+def copy_media_file(src_path, dest_path):
+    """Copy one file without reading it into memory.
+
+    Tries a hardlink first, then copy_file_range, then shutil.copyfile (which
+    uses sendfile/fcopyfile where available and chunked copies otherwise).
+    Returns the method used.
+    """
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+    try:
+        os.link(src_path, dest_path)
+        return "link"
+    except OSError:
+        pass
+    if hasattr(os, "copy_file_range"):
+        try:
+            _kernel_copy(src_path, dest_path)
+            return "copy_file_range"
+        except OSError:
+            pass
+    shutil.copyfile(src_path, dest_path)
+    return "copy"
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaStore:
+    """Content-addressed media folder shared by all exports.
+
+    Files are stored as ``<sha256><ext>`` and reused as long as the source file's
+    size and mtime are unchanged, so repeat exports of the same deck only stat
+    their media. With ``transcode`` on, large images are stored downscaled and
+    re-encoded instead. The store is kept under ``max_bytes`` by evicting the
+    least recently used files.
+    """
+
+    def __init__(self, store_dir, max_bytes=MEDIA_STORE_MAX_BYTES, transcode=False,
+                 max_dimension=TRANSCODE_MAX_DIMENSION):
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self.transcode = transcode
+        self.max_dimension = max_dimension
+        self.index_path = os.path.join(store_dir, MEDIA_INDEX_NAME)
+        self._index = None
+
+    def _load_index(self):
+        if self._index is None:
+            self._index = load_json_cache(self.index_path, "media index") or {}
+            # sources: filename -> [size, mtime_ns, sha256]
+            # blobs: stored name -> {"size": bytes, "used": last export time}
+            self._index.setdefault("sources", {})
+            self._index.setdefault("blobs", {})
+            # transcoded: "sha256:max_dimension" -> stored name, "" if not worth it
+            self._index.setdefault("transcoded", {})
+        return self._index
+
+    def _stage_file(self, filename, src_path):
+        # Runs on a worker thread; only reads the index. Returns what the
+        # caller should record for this file.
+        index = self._index
+        st = os.stat(src_path)
+        known = index["sources"].get(filename)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            digest = known[2]
+        else:
+            digest = hash_file(src_path)
+        ext = os.path.splitext(filename)[1].lower()
+        result = {"source": [st.st_size, st.st_mtime_ns, digest], "copied": False, "transcoded": None}
+
+        if self.transcode and ext in TRANSCODABLE_EXTS:
+            # Transcoded output is cached per source hash and size cap; an
+            # empty name records that transcoding did not pay off.
+            key = f"{digest}:{self.max_dimension}"
+            output = index["transcoded"].get(key)
+            if output and not os.path.exists(os.path.join(self.store_dir, output)):
+                output = None
+            if output is None:
+                output = transcode_image(
+                    src_path, self.store_dir, f"{digest}-{self.max_dimension}", self.max_dimension
+                ) or ""
+                result["copied"] = bool(output)
+            result["transcoded"] = (key, output)
+            if output:
+                result["stored_name"] = output
+                result["size"] = os.path.getsize(os.path.join(self.store_dir, output))
+                return result
+
+        stored_name = digest + ext
+        dest_path = os.path.join(self.store_dir, stored_name)
+        try:
+            present = os.path.getsize(dest_path) == st.st_size
+        except OSError:
+            present = False
+        if not present:
+            tmp_path = f"{dest_path}.{threading.get_ident()}.tmp"
+            copy_media_file(src_path, tmp_path)
+            os.replace(tmp_path, dest_path)
+        result.update(stored_name=stored_name, size=st.st_size, copied=not present)
+        return result
+
+    def stage(self, filenames, src_dir, on_progress=None, max_workers=MAX_STAGING_WORKERS):
+        """Make ``filenames`` from ``src_dir`` available in the store.
+
+        Returns ``{filename: stored_name}`` for every file that was staged.
+        Missing files are skipped. ``on_progress(done, total, filename,
+        stored_name)`` is called from the calling thread as each file finishes;
+        ``stored_name`` is None when that file could not be staged. If it
+        raises, files not yet started are cancelled, the index keeps what was
+        already staged, and the exception propagates.
+        """
+        index = self._load_index()
+        # Collection media is flat, so a directory listing tells us what exists.
+        pending = []
+        for filename in dict.fromkeys(filenames):
+            on_disk = resolve_media_name(src_dir, filename)
+            if on_disk is not None:
+                pending.append((filename, on_disk))
+        staged = {}
+        if not pending:
+            return staged
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        now = int(time.time())
+        copied = 0
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cranky-media") as pool:
+            futures = {
+                pool.submit(self._stage_file, f, os.path.join(src_dir, on_disk)): f for f, on_disk in pending
+            }
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    filename = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        stored_name = None
+                        print(f"⚠️ Could not stage media {filename}: {e}")
+                    else:
+                        stored_name = result["stored_name"]
+                        staged[filename] = stored_name
+                        index["sources"][filename] = result["source"]
+                        index["blobs"][stored_name] = {"size": result["size"], "used": now}
+                        if result["transcoded"]:
+                            key, output = result["transcoded"]
+                            index["transcoded"][key] = output
+                        copied += result["copied"]
+                        count("media_files_staged")
+                        if result["copied"]:
+                            count("media_bytes_copied", result["size"])
+                    if on_progress:
+                        on_progress(done, len(pending), filename, stored_name)
+            except BaseException:
+                # Don't start the remaining files; in-flight ones are left to finish.
+                pool.shutdown(wait=True, cancel_futures=True)
+                self.save()
+                raise
+
+        print(f"[Cranky] Media store: {len(staged)} files staged, {copied} copied")
+        self.evict(keep=set(staged.values()))
+        self.save()
+        return staged
+
+    def evict(self, keep=()):
+        """Drop least recently used files until the store fits in ``max_bytes``.
+
+        Files in ``keep`` are never evicted. Files the index does not know about
+        (such as leftovers from older add-on versions) are removed as well.
+        """
+        index = self._load_index()
+        blobs = index["blobs"]
+        if os.path.isdir(self.store_dir):
+            for fname in os.listdir(self.store_dir):
+                if fname != MEDIA_INDEX_NAME and fname not in blobs:
+                    self._remove(fname)
+
+        total = sum(b["size"] for b in blobs.values())
+        if total <= self.max_bytes:
+            return
+        for stored_name, blob in sorted(blobs.items(), key=lambda item: item[1]["used"]):
+            if total <= self.max_bytes:
+                break
+            if stored_name in keep:
+                continue
+            self._remove(stored_name)
+            del blobs[stored_name]
+            total -= blob["size"]
+
+        # Stored names start with the source hash; forget hashes with no file left.
+        live = {name.split(".")[0].split("-")[0] for name in blobs}
+        index["sources"] = {f: source for f, source in index["sources"].items() if source[2] in live}
+        index["transcoded"] = {
+            key: output for key, output in index["transcoded"].items() if key.split(":")[0] in live
+        }
+
+    def _remove(self, fname):
+        path = os.path.join(self.store_dir, fname)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            print(f"⚠️ Failed to delete {path}: {e}")
+
+    def save(self):
+        if self._index is None:
+            return
+        atomic_write_json(self.index_path, self._index, "media index")
+
+
+def select_media_within_budget(refs, src_dir, max_bytes, max_files):
+    """Pick which referenced media files an export includes.
+
+    ``refs`` maps filename to whether the file is referenced from a question
+    field. Files are ranked images first, then question-field references,
+    then smaller files, and taken greedily while they fit within ``max_bytes``
+    and ``max_files``. Only ``os.stat`` is used, so nothing is read or copied
+    for files that are left out. Returns the set of included filenames.
+    """
+    ranked = []
+    for filename, in_question in refs.items():
+        on_disk = resolve_media_name(src_dir, filename)
+        if on_disk is None:
+            continue
+        try:
+            size = os.stat(os.path.join(src_dir, on_disk)).st_size
+        except OSError:
+            continue
+        is_image = os.path.splitext(filename)[1].lower() in IMAGE_EXTS
+        ranked.append((not is_image, not in_question, size, filename))
+    ranked.sort()
+
+    included = set()
+    total = 0
+    for _, _, size, filename in ranked:
+        if len(included) >= max_files:
+            break
+        if total + size > max_bytes:
+            continue
+        included.add(filename)
+        total += size
+    if len(included) < len(ranked):
+        print(f"[Cranky] Media budget: including {len(included)} of {len(ranked)} files ({total} bytes)")
+    return included
+
+
+def media_manifest(cards):
+    """Return the stored media names referenced by ``cards``, in first-use order."""
+    return list(dict.fromkeys(name for card in cards for name in card.get("images", [])))
@@ -0,0 +1,77 @@
+# metrics.py
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from .config import ADDON_DIR, EXPORT_REPORT
+
+EXPORT_REPORT_PATH = os.path.join(ADDON_DIR, EXPORT_REPORT)
+
+# The run being measured, if any. Exports happen one at a time, so a single
+# module-level run keeps the timers out of every function signature.
+_run = None
+
+
+class ExportRun:
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}    # stage name -> seconds, in first-seen order
+        self.counters = {}  # counter name -> int
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+    def summary(self):
+        lines = [f"{name}: {seconds:.2f}s" for name, seconds in self.stages.items()]
+        lines += [f"{name}: {value}" for name, value in self.counters.items()]
+        return "\n".join(lines)
+
+
+def begin_run():
+    global _run
+    _run = ExportRun()
+    return _run
+
+
+def current_run():
+    return _run
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block under ``name``; does nothing outside a run."""
+    run = _run
+    if run is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.add_time(name, time.perf_counter() - start)
+
+
+def count(name, n=1):
+    if _run is not None:
+        _run.count(name, n)
+
+
+def write_report(path=EXPORT_REPORT_PATH):
+    if _run is None:
+        return
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(_run.report(), f, indent=2)
+    except Exception as e:
+        print(f"⚠️ Could not write export report: {e}")
@@ -0,0 +1,56 @@
+# multipart.py
+
+import mimetypes
+import uuid
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def _quote(value):
+    # HTML5 form encoding of a header parameter value.
+    return value.replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+class MultipartFiles:
+    """A multipart/form-data body of files, streamed from disk.
+
+    ``files`` is a list of ``(field name, filename, path)``. Iterating opens
+    one file at a time and yields the body in chunks of at most ``chunk_size``
+    bytes, so memory and descriptor use do not grow with the number of files.
+    The object has no length, so ``requests`` sends it with chunked transfer
+    encoding, and every iteration produces the body afresh, so a retried
+    request can resend it. Files that cannot be opened are left out.
+    """
+
+    def __init__(self, files, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.files = list(files)
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __iter__(self):
+        boundary = self.boundary.encode("ascii")
+        for field, filename, path in self.files:
+            try:
+                f = open(path, "rb")
+            except OSError as e:
+                print(f"[Cranky] Error opening file {filename}: {e}")
+                continue
+            with f:
+                mime = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                yield (
+                    b"--" + boundary + b"\r\n"
+                    + f'Content-Disposition: form-data; name="{_quote(field)}"; '
+                      f'filename="{_quote(filename)}"\r\n'.encode("utf-8")
+                    + f"Content-Type: {mime}\r\n\r\n".encode("ascii")
+                )
+                while True:
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+                yield b"\r\n"
+        yield b"--" + boundary + b"--\r\n"
@@ -0,0 +1,68 @@
+# ndjson.py
+
+import json
+import os
+
+BODY_CHUNK_SIZE = 64 * 1024
+
+
+class NdjsonWriter:
+    """Write records one JSON document per line as they are produced.
+
+    Output goes to a temporary file that replaces ``path`` only when the writer
+    is closed without an error, so readers never see a half-written export.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.count = 0
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.tmp_path, "w", encoding="utf-8")
+        return self
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._file.write("\n")
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+        return False
+
+
+def iter_ndjson(path):
+    """Lazily yield the records of an NDJSON file; yields nothing if it does not exist."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_json_body(fields, list_key, records, chunk_size=BODY_CHUNK_SIZE):
+    """Yield a JSON object body in byte chunks without building it in memory.
+
+    The object holds ``fields`` plus ``list_key`` mapped to the streamed
+    ``records``. Suitable as a chunked ``requests`` request body.
+    """
+    head = json.dumps(fields, ensure_ascii=False)
+    head = (head[:-1] + ", " if fields else "{") + json.dumps(list_key) + ": ["
+    buf = [head]
+    size = len(head)
+    for i, record in enumerate(records):
+        piece = ("," if i else "") + json.dumps(record, ensure_ascii=False)
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield "".join(buf).encode("utf-8")
+            buf, size = [], 0
+    buf.append("]}")
+    yield "".join(buf).encode("utf-8")
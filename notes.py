@@ -0,0 +1,40 @@
+# notes.py
+
+from anki.utils import ids2str, split_fields
+from aqt import mw
+
+
+def load_notes(note_ids):
+    """Bulk-load the selected notes with a single query against the notes table.
+
+    Returns ``(notes, models)``. ``notes`` maps nid to a dict with ``id``, ``mid``,
+    ``mod``, ``fields`` ({field name: value}) and ``tags``; ``models`` maps each
+    note type id to its note type, resolved once per export.
+    """
+    if not note_ids:
+        return {}, {}
+
+    rows = mw.col.db.all(
+        f"select id, mid, mod, flds, tags from notes where id in {ids2str(note_ids)}"
+    )
+
+    models = {}
+    field_names = {}
+    notes = {}
+    for nid, mid, mod, flds, tags in rows:
+        if mid not in models:
+            model = mw.col.models.get(mid)
+            models[mid] = model
+            if model:
+                field_names[mid] = [f["name"] for f in sorted(model["flds"], key=lambda f: f["ord"])]
+        if not models[mid]:
+            print(f"[Cranky] Skipping note {nid}: missing note type {mid}")
+            continue
+        notes[nid] = {
+            "id": nid,
+            "mid": mid,
+            "mod": mod,
+            "fields": dict(zip(field_names[mid], split_fields(flds))),
+            "tags": tags.split(),
+        }
+    return notes, models
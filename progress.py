@@ -0,0 +1,42 @@
+# progress.py
+
+import threading
+
+
+class ExportCancelled(Exception):
+    """Raised from inside an export once the user has asked to cancel it."""
+
+
+class ExportProgress:
+    """Progress reporting and cooperative cancellation for a background export.
+
+    The export thread calls ``update()`` at each stage and ``check()`` inside
+    long loops; both raise ExportCancelled once ``cancel()`` has been called
+    from the UI. ``on_update(label, done, total)`` is called on the export
+    thread, so it must hand any widget work over to the main thread.
+    """
+
+    def __init__(self, on_update=None):
+        self.on_update = on_update
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise ExportCancelled()
+
+    def wait(self, seconds):
+        """Sleep for up to ``seconds``, returning early with ExportCancelled on cancel."""
+        if self._cancelled.wait(seconds):
+            raise ExportCancelled()
+
+    def update(self, label, done=0, total=0):
+        self.check()
+        if self.on_update:
+            self.on_update(label, done, total)
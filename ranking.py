@@ -0,0 +1,81 @@
+# ranking.py
+
+import heapq
+
+DEFAULT_MODE = "Most Lapses"
+
+# How many scored candidates to take between cancellation checks.
+CANCEL_CHECK_INTERVAL = 1024
+
+# Selection mode name -> scorer. A scorer takes (card_ids, limit) and yields
+# (score, cid, nid) tuples; select_cards() keeps the best ones per note.
+SCORERS = {}
+
+
+def register_scorer(mode):
+    def decorator(func):
+        SCORERS[mode] = func
+        return func
+    return decorator
+
+
+class TopK:
+    """Bounded top-k over streamed ``(score, cid)`` entries, keeping one entry per note."""
+
+    def __init__(self, k):
+        self.k = k
+        self._heap = []  # min-heap of (score, cid, nid), may hold superseded entries
+        self._best = {}  # nid -> (score, cid) of the live entry for that note
+
+    def push(self, score, cid, nid):
+        if self.k <= 0:
+            return
+        best = self._best.get(nid)
+        if best is not None and best[0] >= score:
+            return
+        if best is None and len(self._best) >= self.k and score <= self._floor():
+            return
+        self._best[nid] = (score, cid)
+        heapq.heappush(self._heap, (score, cid, nid))
+        while len(self._best) > self.k:
+            s, c, n = heapq.heappop(self._heap)
+            if self._best.get(n) == (s, c):
+                del self._best[n]
+
+    def _floor(self):
+        # Drop superseded entries until the heap head is live.
+        while self._heap:
+            s, c, n = self._heap[0]
+            if self._best.get(n) == (s, c):
+                return s
+            heapq.heappop(self._heap)
+        return float("-inf")
+
+    def __len__(self):
+        return len(self._best)
+
+    def results(self):
+        """Return the kept ``(score, cid, nid)`` entries, best first."""
+        entries = [(s, c, n) for n, (s, c) in self._best.items()]
+        entries.sort(key=lambda e: (-e[0], e[1]))
+        return entries
+
+
+def select_cards(card_ids, mode, limit, progress=None):
+    """Run the scorer registered for ``mode`` and return up to ``limit`` ``(cid, nid)`` pairs, best first.
+
+    ``progress`` is an optional ExportProgress, checked periodically so a
+    cancelled export stops ranking early.
+    """
+    scorer = SCORERS.get(mode)
+    if scorer is None:
+        print(f"[Cranky] Unknown selection mode {mode!r}, using {DEFAULT_MODE}")
+        scorer = SCORERS[DEFAULT_MODE]
+    if not card_ids or limit <= 0:
+        return []
+    top = TopK(limit)
+    for i, (score, cid, nid) in enumerate(scorer(card_ids, limit)):
+        if progress and i % CANCEL_CHECK_INTERVAL == 0:
+            progress.check()
+        top.push(score, cid, nid)
+    return [(cid, nid) for _, cid, nid in top.results()]
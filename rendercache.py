@@ -0,0 +1,97 @@
+# rendercache.py
+
+import os
+import threading
+import time
+from .config import ADDON_DIR, RENDER_CACHE
+from .utils import atomic_write_json, load_json_cache
+
+RENDER_CACHE_DIR = os.path.join(ADDON_DIR, RENDER_CACHE)
+# Written by versions that kept the whole cache in one file.
+LEGACY_RENDER_CACHE_PATH = os.path.join(ADDON_DIR, "render_cache.json")
+# Bump when the rendered output format or the HTML conversion changes.
+RENDER_CACHE_VERSION = 4
+MAX_RENDER_CACHE_ENTRIES = 20000
+
+# Notes are spread over RENDER_CACHE_SHARDS files by note id. A shard is
+# only read when one of its notes is rendered and only rewritten when one of
+# its entries changed, so an export of a few notes does not load or rewrite
+# the whole cache. Each shard keeps its least recently used entries out once
+# it holds more than its share of MAX_RENDER_CACHE_ENTRIES.
+RENDER_CACHE_SHARDS = 256
+
+# shard number -> {str(nid): {"mod": note mod, "model_mod": note type mod,
+# "used": day last used, "front", "back", "media": raw media filenames,
+# "front_media": those referenced from the question field}}
+_shards = {}
+_dirty = set()
+_lock = threading.Lock()
+
+
+def _today():
+    return int(time.time() // 86400)
+
+
+def _shard_path(shard):
+    return os.path.join(RENDER_CACHE_DIR, f"{shard:02x}.json")
+
+
+def _load_shard(nid):
+    shard = nid % RENDER_CACHE_SHARDS
+    entries = _shards.get(shard)
+    if entries is None:
+        data = load_json_cache(_shard_path(shard), "render cache shard")
+        if isinstance(data, dict) and data.get("version") == RENDER_CACHE_VERSION:
+            entries = data.get("notes", {})
+        else:
+            entries = {}
+        _shards[shard] = entries
+    return shard, entries
+
+
+def get_cached_render(note, model):
+    """Return the cached rendering of ``note``, or None if the note or its note type changed since."""
+    with _lock:
+        shard, entries = _load_shard(note["id"])
+        entry = entries.get(str(note["id"]))
+        if entry is None or entry["mod"] != note["mod"] or entry["model_mod"] != model["mod"]:
+            return None
+        # Recency is kept by day, so repeat exports on one day write nothing.
+        today = _today()
+        if entry.get("used") != today:
+            entry["used"] = today
+            _dirty.add(shard)
+        return {field: entry[field] for field in ("front", "back", "media", "front_media")}
+
+
+def cache_render(note, model, rendered):
+    with _lock:
+        shard, entries = _load_shard(note["id"])
+        entries[str(note["id"])] = {"mod": note["mod"], "model_mod": model["mod"], "used": _today(), **rendered}
+        _dirty.add(shard)
+
+
+def save_render_cache():
+    """Write the shards changed since the last save."""
+    with _lock:
+        if not _dirty:
+            return
+        try:
+            os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+        except OSError as e:
+            print(f"⚠️ Could not save render cache: {e}")
+            return
+        max_entries = max(1, MAX_RENDER_CACHE_ENTRIES // RENDER_CACHE_SHARDS)
+        for shard in sorted(_dirty):
+            entries = _shards[shard]
+            if len(entries) > max_entries:
+                keep = sorted(entries, key=lambda key: entries[key].get("used", 0))[-max_entries:]
+                entries = _shards[shard] = {key: entries[key] for key in keep}
+            data = {"version": RENDER_CACHE_VERSION, "notes": entries}
+            if atomic_write_json(_shard_path(shard), data, "render cache"):
+                _dirty.discard(shard)
+        if os.path.exists(LEGACY_RENDER_CACHE_PATH):
+            try:
+                os.remove(LEGACY_RENDER_CACHE_PATH)
+            except OSError as e:
+                print(f"⚠️ Failed to delete {LEGACY_RENDER_CACHE_PATH}: {e}")
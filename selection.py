@@ -0,0 +1,121 @@
+# selection.py
+
+import random
+import time
+
+from anki.utils import ids2str
+from aqt import mw
+from .config import REVLOG_WINDOW_DAYS
+# select_cards and SCORERS are used through this module, which registers the
+# scorers below on import.
+from .ranking import SCORERS, register_scorer, select_cards
+
+# Card columns that may be ranked in SQL. Column names are interpolated into the
+# query, so only these are accepted.
+RANKABLE_CARD_COLUMNS = ("reps", "lapses")
+
+# Review log metrics, as SQL aggregates over a per-answer subquery with columns
+# ease, time (ms), factor (permille, 0 outside review), type and day (days
+# since the window start). Higher always means harder.
+REVLOG_METRICS = {
+    "failure_rate": "avg(ease = 1)",
+    "mean_time": "avg(time) / 1000.0",
+    # Least-squares slope of the ease factor over the window, negated and in
+    # percentage points per day, so falling ease ranks first.
+    "ease_trend": (
+        "-(sum(factor > 0) * sum((factor > 0) * day * factor) - sum((factor > 0) * day) * sum(factor))"
+        " / nullif(sum(factor > 0) * sum((factor > 0) * day * day) - sum((factor > 0) * day) * sum((factor > 0) * day), 0)"
+        " / 10.0"
+    ),
+    "lapse_rate": "1.0 * sum(type = 1 and ease = 1) / nullif(sum(type = 1), 0)",
+}
+
+# Cards with fewer answers in the window than this are not ranked by the
+# revlog metrics; a single failed answer would otherwise top every list.
+REVLOG_MIN_ANSWERS = 2
+
+
+def top_notes_by_card_column(card_ids, column, limit):
+    """Rank notes by the highest ``column`` value among their cards in ``card_ids``.
+
+    The per-note max and the top-N cut are done in a single aggregate query, so
+    the cost is one database round trip regardless of scope size. Returns up to
+    ``limit`` ``(cid, nid, value)`` rows, where ``cid`` is the note's card that
+    holds the maximum.
+    """
+    if column not in RANKABLE_CARD_COLUMNS:
+        raise ValueError(f"Cannot rank cards by column: {column}")
+    if not card_ids or limit <= 0:
+        return []
+    # SQLite returns the bare ``id`` column from the row that holds max().
+    return mw.col.db.all(
+        f"select id, nid, max({column}) as score from cards "
+        f"where id in {ids2str(card_ids)} "
+        f"group by nid order by score desc, nid limit ?",
+        limit,
+    )
+
+
+@register_scorer("Most Lapses")
+def score_most_lapses(card_ids, limit):
+    for cid, nid, lapses in top_notes_by_card_column(card_ids, "lapses", limit):
+        yield lapses, cid, nid
+
+
+@register_scorer("Most Repetitions")
+def score_most_repetitions(card_ids, limit):
+    for cid, nid, reps in top_notes_by_card_column(card_ids, "reps", limit):
+        yield reps, cid, nid
+
+
+def card_revlog_metric(card_ids, metric, days=REVLOG_WINDOW_DAYS, min_answers=REVLOG_MIN_ANSWERS):
+    """Compute ``metric`` from the review log for each card in ``card_ids``.
+
+    Only answers from the last ``days`` days count. Everything is aggregated
+    in one query over the revlog cid index, so the cost does not depend on
+    how much older history the collection has. Returns ``(cid, nid, value)``
+    rows; cards without enough answers, or for which the metric is undefined,
+    are left out.
+    """
+    expr = REVLOG_METRICS.get(metric)
+    if expr is None:
+        raise ValueError(f"Unknown revlog metric: {metric}")
+    if not card_ids:
+        return []
+    cutoff = int((time.time() - days * 86400) * 1000)
+    # Manual reschedules are logged with ease 0 and are not answers.
+    return mw.col.db.all(
+        f"select cid, nid, {expr} as value from ("
+        f"select r.cid, c.nid, r.ease, r.time, r.factor, r.type, (r.id - ?) / 86400000.0 as day "
+        f"from revlog r join cards c on c.id = r.cid "
+        f"where r.cid in {ids2str(card_ids)} and r.id > ? and r.ease > 0"
+        f") group by cid having count(*) >= ? and value is not null",
+        cutoff, cutoff, min_answers,
+    )
+
+
+def _revlog_scorer(metric):
+    def scorer(card_ids, limit):
+        for cid, nid, value in card_revlog_metric(card_ids, metric):
+            yield value, cid, nid
+    return scorer
+
+
+REVLOG_MODES = {
+    "Highest Recent Failure Rate": "failure_rate",
+    "Slowest Recent Answers": "mean_time",
+    "Falling Ease": "ease_trend",
+    "Most Lapses per Review": "lapse_rate",
+}
+for _mode, _metric in REVLOG_MODES.items():
+    register_scorer(_mode)(_revlog_scorer(_metric))
+
+
+@register_scorer("Random")
+def score_random(card_ids, limit):
+    # One candidate per note, so notes with many cards are not favoured.
+    rows = mw.col.db.all(
+        f"select min(id), nid from cards where id in {ids2str(card_ids)} group by nid"
+    )
+    for cid, nid in rows:
+        yield random.random(), cid, nid
@@ -0,0 +1,118 @@
+# status.py
+
+import json
+import time
+
+import requests
+from . import api
+from .metrics import count, stage
+
+# Without server push, the poll interval starts at POLL_MIN_INTERVAL, grows by
+# POLL_BACKOFF while the status stays the same and drops back when it changes.
+# Early on it is capped lower, since the first phases are short.
+POLL_MIN_INTERVAL = 1.0
+POLL_EARLY_MAX_INTERVAL = 5.0
+POLL_MAX_INTERVAL = 15.0
+POLL_EARLY_SECONDS = 60
+POLL_BACKOFF = 1.5
+
+# Servers that support long polling may hold a status request for up to this
+# many seconds until something changes; others ignore the parameter.
+LONG_POLL_SECONDS = 25
+STATUS_TIMEOUT = 45 * 60
+
+
+def is_complete(status):
+    return "complete" in status.lower()
+
+
+def next_poll_interval(interval, changed, elapsed):
+    if changed:
+        return POLL_MIN_INTERVAL
+    cap = POLL_EARLY_MAX_INTERVAL if elapsed < POLL_EARLY_SECONDS else POLL_MAX_INTERVAL
+    return min(cap, interval * POLL_BACKOFF)
+
+
+def report_status(progress, data):
+    """Show a status update on ``progress``; returns the status string."""
+    status = str(data.get("status", "pending"))
+    percent = data.get("progress")
+    if isinstance(percent, (int, float)) and 0 <= percent <= 100:
+        progress.update(f"Generating scene: {status}", int(percent), 100)
+    else:
+        progress.update(f"Generating scene: {status}")
+    print(f"[Cranky] Status: {status}")
+    return status
+
+
+def _follow_events(resp, progress):
+    # Read a text/event-stream of JSON status objects; returns True once one
+    # reports completion, False if the stream ends first.
+    data_lines = []
+    for line in resp.iter_lines(decode_unicode=True):
+        progress.check()
+        if line:
+            if line.startswith("data:"):
+                data_lines.append(line[5:].lstrip())
+            continue
+        if not data_lines:
+            continue  # comment or keep-alive
+        try:
+            data = json.loads("\n".join(data_lines))
+        except ValueError:
+            data = {"status": "\n".join(data_lines)}
+        data_lines = []
+        if is_complete(report_status(progress, data)):
+            return True
+    return False
+
+
+def watch_scene_status(session_id, headers, progress, timeout=STATUS_TIMEOUT):
+    """Block until the scene ``session_id`` reports completion.
+
+    The status endpoint is asked for an event stream first; if it answers
+    with one, updates are pushed and no polling happens. Otherwise requests
+    are long-poll hints, and when the server answers straight away the next
+    poll is delayed adaptively. Every update goes to ``progress``. Raises
+    TimeoutError after ``timeout`` seconds and ExportCancelled on cancel.
+    """
+    print(f"[Cranky] Begin watching status for session {session_id}")
+    started = time.monotonic()
+    interval = POLL_MIN_INTERVAL
+    last_status = None
+    while time.monotonic() - started < timeout:
+        sent = time.monotonic()
+        count("status_requests")
+        with stage("status_polling"):
+            resp = api.request(
+                "GET", f"/v2/status/{session_id}", "status", progress=progress, stream=True,
+                params={"wait": LONG_POLL_SECONDS},
+                headers={**headers, "Accept": "text/event-stream, application/json"},
+            )
+        try:
+            if resp.status_code == 200 and resp.headers.get("Content-Type", "").startswith("text/event-stream"):
+                try:
+                    if _follow_events(resp, progress):
+                        return
+                except requests.RequestException as e:
+                    print(f"[Cranky] Status stream interrupted: {e}")
+                # The stream closed before completion: reconnect shortly.
+                progress.wait(POLL_MIN_INTERVAL)
+                continue
+            if resp.status_code != 200:
+                print(f"[Cranky] Polling non-200 status: {resp.status_code} {resp.text}")
+                status = last_status
+            else:
+                status = report_status(progress, resp.json())
+                if is_complete(status):
+                    return
+        finally:
+            resp.close()
+
+        now = time.monotonic()
+        interval = next_poll_interval(interval, status != last_status, now - started)
+        last_status = status
+        # A request the server held open was a long poll; ask again at once.
+        if now - sent < LONG_POLL_SECONDS / 2:
+            progress.wait(interval)
+    raise TimeoutError(f"Scene {session_id} was not ready after {timeout} seconds")
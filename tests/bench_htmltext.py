@@ -0,0 +1,47 @@
+# bench_htmltext.py
+"""Time html_to_text against the old strip_clozes + re.sub cascade.
+
+Run from the add-on directory:  python tests/bench_htmltext.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import conftest  # noqa: F401  (registers the add-on package as "cranky")
+from cranky.htmltext import _convert
+from test_htmltext import reference_html_to_text, reference_strip_clozes
+
+CASES = {
+    "short": 'What is the <b>capital</b> of {{c1::France::country}}?<br><img src="paste-123.png">',
+    "medium": (
+        "<div>" + "Lorem ipsum dolor sit amet, <i>consectetur</i> adipiscing elit &amp; more. " * 20
+        + "</div><ul><li>a</li><li>b</li></ul>"
+    ),
+    "text-heavy": "Plain text without much markup. " * 3000 + "<br>end",
+    "image-heavy": "".join(
+        '<div><img src="paste-%08d.jpg" style="max-width:100%%"></div><br>{{c1::answer %d::hint}} text &nbsp;\n' % (i, i)
+        for i in range(2000)
+    ),
+    "image-gallery": "".join('<img src="scan-%05d.png">' % i for i in range(5000)),
+    "tag-dense-cloze": "".join(
+        "{{c%d::<b><i>%d</i></b><sub>x</sub>}}<span>&amp;</span>" % (i % 9 + 1, i) for i in range(3000)
+    ),
+}
+
+
+def main():
+    for name, html in CASES.items():
+        assert _convert(html, True) == reference_html_to_text(reference_strip_clozes(html)), name
+        number = 2000 if len(html) < 5000 else 30
+        # _convert bypasses the result cache, which would otherwise make
+        # every call after the first a lookup.
+        old = timeit.timeit(lambda: reference_html_to_text(reference_strip_clozes(html)), number=number) / number
+        new = timeit.timeit(lambda: _convert(html, True), number=number) / number
+        print(f"{name:16} {len(html):8} chars  old {old * 1e3:8.3f}ms  new {new * 1e3:8.3f}ms  x{old / new:.2f}")
+
+
+if __name__ == "__main__":
+    main()
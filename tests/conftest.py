@@ -0,0 +1,29 @@
+# conftest.py
+
+import importlib.machinery
+import os
+import sys
+import types
+
+# The add-on package imports aqt on load, which is only available inside
+# Anki. Register a bare package for the add-on directory instead, under its
+# directory name (which pytest uses for the top-level __init__.py) and as
+# "cranky", so modules that do not need Anki can be imported, relative
+# imports included, as cranky.<module>.
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _register_addon_package():
+    if "cranky" in sys.modules:
+        return
+    init = os.path.join(ADDON_DIR, "__init__.py")
+    package = types.ModuleType("cranky")
+    package.__file__ = init
+    package.__path__ = [ADDON_DIR]
+    package.__spec__ = importlib.machinery.ModuleSpec("cranky", None, origin=init, is_package=True)
+    package.__spec__.submodule_search_locations = package.__path__
+    sys.modules["cranky"] = package
+    sys.modules.setdefault(os.path.basename(ADDON_DIR), package)
+
+
+_register_addon_package()
@@ -0,0 +1,67 @@
+# test_budget.py
+
+from cranky.budget import ELLIPSIS, PayloadBudget, estimate_tokens, trim_card, trim_to_tokens
+from cranky.config import CARD_TOKEN_BUDGET, PAYLOAD_TOKEN_BUDGET
+
+
+def test_short_text_is_untouched():
+    assert trim_to_tokens("short", 10) == "short"
+    assert trim_to_tokens("anything", 0) == ""
+
+
+def test_cut_prefers_paragraph_then_sentence_then_word_boundaries():
+    paragraphs = "First paragraph is here.\n\nSecond paragraph follows with more words."
+    assert trim_to_tokens(paragraphs, 10) == "First paragraph is here." + ELLIPSIS
+
+    sentences = "One sentence here. Another one that goes on and on."
+    assert trim_to_tokens(sentences, 7) == "One sentence here." + ELLIPSIS
+
+    words = "alpha beta gamma delta epsilon zeta eta theta"
+    assert trim_to_tokens(words, 6) == "alpha beta gamma" + ELLIPSIS
+
+
+def test_boundary_is_skipped_when_it_would_keep_too_little():
+    text = "a. " + "x" * 200
+    trimmed = trim_to_tokens(text, 10)
+    assert trimmed.startswith("a. xxx")
+    assert trimmed.endswith(ELLIPSIS)
+
+
+def test_ellipsis_counts_against_the_budget():
+    text = "word " * 500
+    for max_tokens in (1, 2, 5, 17, 100):
+        assert estimate_tokens(trim_to_tokens(text, max_tokens)) <= max_tokens
+
+
+def test_trimming_is_deterministic():
+    text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 40
+    assert trim_to_tokens(text, 50) == trim_to_tokens(text, 50)
+
+
+def test_trim_card_gives_the_front_at_most_half_unless_the_back_is_short():
+    front, back = "f" * 400, "b" * 400
+    trimmed_front, trimmed_back = trim_card(front, back, 50)
+    assert estimate_tokens(trimmed_front) <= 25
+    assert estimate_tokens(trimmed_front) + estimate_tokens(trimmed_back) <= 50
+
+    trimmed_front, trimmed_back = trim_card(front, "short", 50)
+    assert trimmed_back == "short"
+    assert estimate_tokens(trimmed_front) > 25
+
+
+def test_payload_stays_within_budget():
+    cards = 25
+    budget = PayloadBudget(PAYLOAD_TOKEN_BUDGET, CARD_TOKEN_BUDGET, cards)
+    for i in range(cards):
+        front, back = budget.fit(f"question {i} " * 300, f"answer {i} " * 600)
+        assert estimate_tokens(front) + estimate_tokens(back) <= CARD_TOKEN_BUDGET
+    assert budget.used <= PAYLOAD_TOKEN_BUDGET
+
+
+def test_card_cap_applies_once_short_cards_leave_budget_unused():
+    cards = 25
+    budget = PayloadBudget(PAYLOAD_TOKEN_BUDGET, CARD_TOKEN_BUDGET, cards)
+    for _ in range(cards - 1):
+        budget.fit("short", "card")
+    front, back = budget.fit("q " * 2000, "a " * 2000)
+    assert estimate_tokens(front) + estimate_tokens(back) == CARD_TOKEN_BUDGET
@@ -0,0 +1,33 @@
+# test_dedup.py
+
+import random
+
+from cranky.dedup import NUM_BINS, NearDuplicateFilter, shingles, signature
+
+
+def reference_signature(texts, tokens=()):
+    # Per-bin minimum of the shingle hashes, by brute force.
+    hashes = set(map(hash, tokens))
+    for text in texts:
+        hashes |= set(map(hash, shingles(text)))
+    return [min((h for h in hashes if h % NUM_BINS == b), default=None) for b in range(NUM_BINS)]
+
+
+def test_signature_is_the_per_bin_minimum():
+    rng = random.Random(3)
+    words = ["capital", "France", "Paris", "river", "Seine", "mitochondria", "ATP", "{{c1::x}}", "&"]
+    for _ in range(200):
+        front = " ".join(rng.choices(words, k=rng.randint(0, 12)))
+        back = " ".join(rng.choices(words, k=rng.randint(0, 30)))
+        assert signature([front, back], ["img:a.png"]) == reference_signature([front, back], ["img:a.png"])
+    assert signature(["", ""]) == [None] * NUM_BINS
+    assert signature(["ab"]) == reference_signature(["ab"])
+
+
+def test_filter_collapses_near_duplicates():
+    dedup = NearDuplicateFilter(0.8)
+    assert dedup.add(1, signature(["What is the capital of France?", "Paris"])) is None
+    assert dedup.add(2, signature(["Paris", "What is the capital of France"])) == 1
+    assert dedup.add(3, signature(["What is the capital of Germany?", "Berlin"])) is None
+    assert dedup.add(4, signature(["", ""], ["img:a.png"])) is None
+    assert dedup.add(5, signature(["", ""], ["img:b.png"])) is None
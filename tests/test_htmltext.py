@@ -0,0 +1,122 @@
+# test_htmltext.py
+"""Parity of htmltext.html_to_text with the converter it replaced.
+
+The reference below is the old strip_clozes() + re.sub cascade from
+cards.py, kept verbatim. html_to_text must give the same text for the
+fixed cases and for seeded random mixes of the markup fields contain,
+including adversarial ones (a literal "<" spanning cloze markup,
+overlapping style and script blocks). bench_htmltext.py compares speed.
+"""
+
+import html as html_lib
+import random
+import re
+
+import pytest
+
+from cranky import htmltext
+from cranky.htmltext import html_to_text
+
+FUZZ_SEED = 1
+FUZZ_CASES = 20000
+
+
+def reference_strip_clozes(text):
+    return re.sub(r'{{c\d+::(.*?)(::.*?)?}}', r'\1', text)
+
+
+def reference_html_to_text(html):
+    html = re.sub(r'<style.*?>.*?</style>', '', html, flags=re.DOTALL | re.IGNORECASE)
+    html = re.sub(r'<script.*?>.*?</script>', '', html, flags=re.DOTALL | re.IGNORECASE)
+    html = re.sub(r'</li\s*>', '\n', html, flags=re.IGNORECASE)
+    html = re.sub(r'<li\s*>', '• ', html, flags=re.IGNORECASE)
+    html = re.sub(r'<(ul|ol).*?>', '\n', html, flags=re.IGNORECASE)
+    html = re.sub(r'</(ul|ol)>', '\n', html, flags=re.IGNORECASE)
+    html = re.sub(r'<br\s*/?>', '\n', html, flags=re.IGNORECASE)
+    html = re.sub(r'</?div.*?>', '\n', html, flags=re.IGNORECASE)
+    html = re.sub(r'<.*?>', '', html)
+    text = html_lib.unescape(html)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+
+FIXED_CASES = [
+    "Hello <b>world</b>",
+    "{{c1::Paris::capital}} is in France",
+    "<ul><li>a</li><li>b</li></ul>",
+    "a<br>b<br/>c<br />d",
+    "<div>x</div><div>y</div>",
+    "<style>.a{}</style>text<script>x</script>",
+    "&amp; &lt; &nbsp; &#39; &#x41;",
+    "a &amp b",
+    "<img src='a.png'><img src=\"b.png\">",
+    "x < y and y > z",
+    "5 < 6",
+    "<p>para</p><p>two</p>",
+    "{{c1::a}} {{c2::b::h}}",
+    "<LI>up</LI>",
+    "<li class='x'>attr</li>",
+    "\n\n\n\nfoo\n\n\n\nbar",
+    "<div\nclass='x'>multi</div>",
+    "<b\n>multi</b>",
+    "&notit; &notin;",
+    "AT&T",
+    "{{c1::<b>bold</b>}}",
+    "<a href='x'>{{c1::y}}</a>",
+    "  &nbsp;  ",
+    "<style>unclosed",
+    "<scriptx>hmm</scriptx>",
+    "<br>\n<br>\n<br>",
+    "&lt;b&gt;escaped&lt;/b&gt;",
+    "<ol type=1><li >one</li ></ol>",
+    "{{c1::unclosed",
+    "{{c1::two\nlines}}",
+    "<div><img src=\"paste-1.jpg\" style=\"max-width:100%\"></div><br>{{c1::answer::hint}} text &nbsp;",
+]
+
+FUZZ_TOKENS = [
+    "a", "b", " ", "\n", "<b>", "</b>", "<br>", "<div>", "</div>", "<li>", "</li>",
+    "<ul>", "</ul>", "<style>", "</style>", "<script>", "</script>", "&amp;",
+    "&nbsp;", "&", "<", "<", "{{c1::", "}}", "::", "<img src='x'>", "&#39;",
+    "&lt;", ">", "<p", "{{c2::", "&amp", "<LI >", "<ol type=1>", "</ol>",
+    "<br/>", "<Div class='x'>",
+]
+
+
+def fuzz_inputs():
+    rng = random.Random(FUZZ_SEED)
+    for _ in range(FUZZ_CASES):
+        yield "".join(rng.choice(FUZZ_TOKENS) for _ in range(rng.randint(1, 12)))
+
+
+@pytest.mark.parametrize("html", FIXED_CASES)
+def test_fixed_cases_match_reference(html):
+    assert html_to_text(html) == reference_html_to_text(reference_strip_clozes(html))
+    assert html_to_text(html, strip_clozes=False) == reference_html_to_text(html)
+
+
+def test_fuzz_matches_reference():
+    for html in fuzz_inputs():
+        assert html_to_text(html) == reference_html_to_text(reference_strip_clozes(html)), html
+        assert html_to_text(html, strip_clozes=False) == reference_html_to_text(html), html
+
+
+@pytest.mark.parametrize("html", [
+    "{{c2::<p}}::</b>",
+    "<{{c1::>}}  <div></b><b><li>\nb",
+    "<script><style></script>x</style>",
+    "<scr<style>x</style>ipt>gone</script>kept",
+    "<DİV>dotted</DİV><ſtyle>long s</ſtyle>",
+])
+def test_adversarial_cases_match_reference(html):
+    assert html_to_text(html) == reference_html_to_text(reference_strip_clozes(html))
+    assert html_to_text(html, strip_clozes=False) == reference_html_to_text(html)
+
+
+def test_results_are_cached():
+    html = "<div>cached {{c1::field}}</div>"
+    before = htmltext.field_text_cache_info()
+    first = html_to_text(html)
+    assert html_to_text(html) == first
+    after = htmltext.field_text_cache_info()
+    assert after["hits"] >= before["hits"] + 1
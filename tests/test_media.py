@@ -0,0 +1,54 @@
+# test_media.py
+
+import os
+import unicodedata
+
+import pytest
+
+from cranky.media import extract_media_names, resolve_media_name, select_media_within_budget
+
+
+@pytest.fixture
+def media_dir(tmp_path):
+    media = tmp_path / "media"
+    media.mkdir()
+    (media / "a.png").write_bytes(b"a")
+    (media / unicodedata.normalize("NFD", "Café.PNG")).write_bytes(b"cafe")
+    (tmp_path / "secret.txt").write_text("outside the media folder")
+    return str(media)
+
+
+def test_extract_unquotes_entity_quoted_urls():
+    html = (
+        '<div style="background:url(&quot;n.png&quot;)"></div>'
+        "<span style=\"background:url(&#39;m.png&#39;)\"></span>"
+        '<img src="a&amp;b.png">[sound:x.mp3]'
+    )
+    assert extract_media_names(html) == ["n.png", "m.png", "a&b.png", "x.mp3"]
+
+
+def test_resolve_matches_case_and_normalisation(media_dir):
+    assert resolve_media_name(media_dir, "a.png") == "a.png"
+    assert resolve_media_name(media_dir, "café.png") == unicodedata.normalize("NFD", "Café.PNG")
+    assert resolve_media_name(media_dir, "missing.png") is None
+
+
+@pytest.mark.parametrize("name", [
+    "../secret.txt",
+    "..",
+    "sub/a.png",
+    "..\\secret.txt",
+    "https://example.com/a.png",
+    "data:image/png;base64,AAAA",
+])
+def test_resolve_rejects_paths_and_urls(media_dir, name, monkeypatch):
+    def no_disk_access(*args):
+        raise AssertionError("resolve_media_name touched the disk")
+
+    monkeypatch.setattr(os.path, "exists", no_disk_access)
+    assert resolve_media_name(media_dir, name) is None
+
+
+def test_budget_skips_references_outside_the_media_folder(media_dir):
+    refs = {"../secret.txt": True, "a.png": False}
+    assert select_media_within_budget(refs, media_dir, 1024, 10) == {"a.png"}
@@ -0,0 +1,56 @@
+# test_multipart.py
+
+import email.parser
+import email.policy
+
+from cranky.multipart import MultipartFiles, _quote
+
+
+def parse(body, content_type):
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("ascii") + b"\r\n\r\n" + body
+    )
+    return [
+        (part.get_param("name", header="content-disposition"), part.get_filename(), part.get_content_type(),
+         part.get_payload(decode=True))
+        for part in message.iter_parts()
+    ]
+
+
+def test_body_holds_each_file(tmp_path):
+    (tmp_path / "a.png").write_bytes(b"\x89PNG" + bytes(range(256)) * 10)
+    (tmp_path / "b.txt").write_bytes(b"hello")
+    body = MultipartFiles([
+        ("files", "a.png", str(tmp_path / "a.png")),
+        ("files", "b.txt", str(tmp_path / "b.txt")),
+    ], chunk_size=100)
+    assert parse(b"".join(body), body.content_type) == [
+        ("files", "a.png", "image/png", b"\x89PNG" + bytes(range(256)) * 10),
+        ("files", "b.txt", "text/plain", b"hello"),
+    ]
+
+
+def test_body_can_be_iterated_again_for_a_retry(tmp_path):
+    (tmp_path / "a.bin").write_bytes(b"x" * 1000)
+    body = MultipartFiles([("files", "a.bin", str(tmp_path / "a.bin"))], chunk_size=64)
+    first = list(body)
+    assert list(body) == first
+    assert all(len(chunk) <= 200 for chunk in first)
+
+
+def test_unreadable_files_are_left_out(tmp_path):
+    (tmp_path / "a.txt").write_bytes(b"kept")
+    body = MultipartFiles([
+        ("files", "gone.txt", str(tmp_path / "gone.txt")),
+        ("files", "a.txt", str(tmp_path / "a.txt")),
+    ])
+    assert [part[1] for part in parse(b"".join(body), body.content_type)] == ["a.txt"]
+
+
+def test_no_files_gives_just_the_closing_boundary():
+    body = MultipartFiles([])
+    assert b"".join(body) == b"--" + body.boundary.encode("ascii") + b"--\r\n"
+
+
+def test_header_values_are_form_encoded():
+    assert _quote('a"b\r\n.png') == "a%22b%0D%0A.png"
@@ -0,0 +1,48 @@
+# test_ndjson.py
+
+import json
+
+import pytest
+
+from cranky.ndjson import NdjsonWriter, iter_json_body, iter_ndjson
+
+
+def body(*args, **kwargs):
+    return json.loads(b"".join(iter_json_body(*args, **kwargs)).decode("utf-8"))
+
+
+def test_empty_record_list():
+    assert body({"theme": "castle"}, "cards", []) == {"theme": "castle", "cards": []}
+    assert body({}, "cards", iter(())) == {"cards": []}
+
+
+def test_records_are_streamed_in_chunks():
+    records = [{"uid": str(i), "front": "Café ✓ " * 20} for i in range(100)]
+    chunks = list(iter_json_body({"theme": "x", "n": 1}, "cards", iter(records), chunk_size=1024))
+    assert len(chunks) > 1
+    assert json.loads(b"".join(chunks).decode("utf-8")) == {"theme": "x", "n": 1, "cards": records}
+
+
+def test_writer_round_trip(tmp_path):
+    path = str(tmp_path / "cards.ndjson")
+    with NdjsonWriter(path) as writer:
+        writer.write({"uid": "1", "front": "ä"})
+        writer.write({"uid": "2"})
+    assert writer.count == 2
+    assert list(iter_ndjson(path)) == [{"uid": "1", "front": "ä"}, {"uid": "2"}]
+
+
+def test_failed_write_keeps_the_previous_file(tmp_path):
+    path = str(tmp_path / "cards.ndjson")
+    with NdjsonWriter(path) as writer:
+        writer.write({"uid": "old"})
+    with pytest.raises(RuntimeError):
+        with NdjsonWriter(path) as writer:
+            writer.write({"uid": "new"})
+            raise RuntimeError
+    assert list(iter_ndjson(path)) == [{"uid": "old"}]
+    assert not (tmp_path / "cards.ndjson.tmp").exists()
+
+
+def test_missing_file_yields_nothing(tmp_path):
+    assert list(iter_ndjson(str(tmp_path / "missing.ndjson"))) == []
@@ -0,0 +1,67 @@
+# test_ranking.py
+
+import pytest
+
+from cranky import ranking
+from cranky.ranking import DEFAULT_MODE, TopK, select_cards
+
+
+def test_note_improving_its_score_replaces_its_entry():
+    top = TopK(2)
+    top.push(1, 10, 100)
+    top.push(2, 20, 200)
+    top.push(5, 11, 100)  # a better card of note 100
+    top.push(3, 12, 100)  # worse than note 100's best, ignored
+    assert top.results() == [(5, 11, 100), (2, 20, 200)]
+    assert len(top) == 2
+
+
+def test_superseded_entries_do_not_count_against_capacity():
+    top = TopK(2)
+    top.push(1, 10, 100)
+    top.push(2, 10, 100)
+    top.push(3, 10, 100)
+    top.push(1, 20, 200)
+    assert top.results() == [(3, 10, 100), (1, 20, 200)]
+
+
+def test_lowest_note_is_evicted_at_capacity():
+    top = TopK(2)
+    for score, cid, nid in [(3, 1, 1), (1, 2, 2), (2, 3, 3), (0, 4, 4)]:
+        top.push(score, cid, nid)
+    assert top.results() == [(3, 1, 1), (2, 3, 3)]
+
+
+def test_ties_keep_the_first_entry_and_order_by_card_id():
+    top = TopK(2)
+    top.push(1, 30, 3)
+    top.push(1, 10, 1)
+    top.push(1, 20, 2)  # ties the floor, so not taken
+    top.push(1, 11, 1)  # ties note 1's own score, so not taken
+    assert top.results() == [(1, 10, 1), (1, 30, 3)]
+
+
+def test_zero_capacity_keeps_nothing():
+    top = TopK(0)
+    top.push(5, 1, 1)
+    assert len(top) == 0
+    assert top.results() == []
+
+
+@pytest.fixture
+def scorers(monkeypatch):
+    registered = {}
+    monkeypatch.setattr(ranking, "SCORERS", registered)
+    return registered
+
+
+def test_select_cards_ranks_per_note(scorers):
+    scorers["Test"] = lambda card_ids, limit: iter([(1, 10, 1), (4, 11, 1), (3, 20, 2), (2, 30, 3)])
+    assert select_cards([10, 11, 20, 30], "Test", 2) == [(11, 1), (20, 2)]
+    assert select_cards([], "Test", 2) == []
+    assert select_cards([10], "Test", 0) == []
+
+
+def test_select_cards_falls_back_to_the_default_mode(scorers):
+    scorers[DEFAULT_MODE] = lambda card_ids, limit: iter([(1, cid, cid) for cid in card_ids])
+    assert select_cards([1, 2], "No such mode", 5) == [(1, 1), (2, 2)]
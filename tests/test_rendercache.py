@@ -0,0 +1,60 @@
+# test_rendercache.py
+
+import json
+import os
+
+import pytest
+
+from cranky import rendercache
+
+RENDERED = {"front": "q", "back": "a", "media": [], "front_media": []}
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(rendercache, "RENDER_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(rendercache, "LEGACY_RENDER_CACHE_PATH", str(tmp_path / "render_cache.json"))
+    monkeypatch.setattr(rendercache, "_shards", {})
+    monkeypatch.setattr(rendercache, "_dirty", set())
+    return tmp_path
+
+
+def note(nid, mod=1):
+    return {"id": nid, "mod": mod}
+
+
+MODEL = {"mod": 7}
+
+
+def test_only_changed_shards_are_written(cache_dir):
+    rendercache.cache_render(note(1), MODEL, RENDERED)
+    rendercache.cache_render(note(2), MODEL, RENDERED)
+    rendercache.save_render_cache()
+    assert sorted(os.listdir(cache_dir)) == ["01.json", "02.json"]
+
+    os.remove(cache_dir / "01.json")
+    rendercache.cache_render(note(2, mod=2), MODEL, RENDERED)
+    rendercache.save_render_cache()
+    assert sorted(os.listdir(cache_dir)) == ["02.json"]
+
+
+def test_entries_survive_reload_and_go_stale_on_edit(cache_dir, monkeypatch):
+    rendercache.cache_render(note(5), MODEL, RENDERED)
+    rendercache.save_render_cache()
+    monkeypatch.setattr(rendercache, "_shards", {})
+
+    assert rendercache.get_cached_render(note(5), MODEL) == RENDERED
+    assert rendercache.get_cached_render(note(5, mod=2), MODEL) is None
+    assert rendercache.get_cached_render(note(5), {"mod": 8}) is None
+
+
+def test_full_shard_drops_least_recently_used(cache_dir, monkeypatch):
+    monkeypatch.setattr(rendercache, "MAX_RENDER_CACHE_ENTRIES", 2 * rendercache.RENDER_CACHE_SHARDS)
+    step = rendercache.RENDER_CACHE_SHARDS
+    for day, nid in enumerate((step, 2 * step, 3 * step)):
+        monkeypatch.setattr(rendercache, "_today", lambda day=day: day)
+        rendercache.cache_render(note(nid), MODEL, RENDERED)
+    rendercache.save_render_cache()
+
+    with open(cache_dir / "00.json", encoding="utf-8") as f:
+        assert sorted(json.load(f)["notes"]) == [str(2 * step), str(3 * step)]
@@ -0,0 +1,70 @@
+# test_upload.py
+
+import pytest
+
+from cranky.upload import plan_batches
+
+
+@pytest.fixture
+def make_files(tmp_path):
+    def make(*sizes):
+        files = []
+        for i, size in enumerate(sizes):
+            path = tmp_path / f"f{i}.bin"
+            path.write_bytes(b"x" * size)
+            files.append(("files", f"f{i}.bin", str(path)))
+        return files
+    return make
+
+
+def names(batches):
+    return [[name for _, name, _ in batch] for batch in batches]
+
+
+def test_no_files_means_no_batches():
+    assert plan_batches([]) == []
+
+
+def test_every_file_is_planned_once_in_original_order(make_files):
+    files = make_files(5, 40, 10, 30, 20, 25)
+    batches = plan_batches(files, max_bytes=60, max_files=10)
+    planned = [name for batch in names(batches) for name in batch]
+    assert sorted(planned) == sorted(name for _, name, _ in files)
+    for batch in names(batches):
+        assert batch == sorted(batch, key=lambda name: int(name[1:-4]))
+
+
+def test_batches_are_balanced_by_size(make_files):
+    sizes = [50, 40, 30, 20, 10, 10]
+    files = make_files(*sizes)
+    batches = plan_batches(files, max_bytes=90, max_files=10)
+    assert len(batches) == 2
+    totals = [sum(sizes[int(name[1:-4])] for name in batch) for batch in names(batches)]
+    assert sorted(totals) == [80, 80]
+
+
+def test_file_larger_than_a_batch_gets_its_own(make_files):
+    files = make_files(500, 10, 10)
+    batches = plan_batches(files, max_bytes=100, max_files=10)
+    assert ["f0.bin"] in names(batches)
+    assert all(len(batch) <= 10 for batch in batches)
+
+
+def test_full_batches_are_skipped(make_files):
+    # The largest file fills the lightest batch, which must then be passed
+    # over once it holds max_files files.
+    files = make_files(100, 1, 1, 1, 1, 1)
+    batches = plan_batches(files, max_bytes=10_000, max_files=2)
+    assert len(batches) == 3
+    assert all(len(batch) <= 2 for batch in batches)
+    assert sum(len(batch) for batch in batches) == len(files)
+
+
+def test_min_batches_spreads_few_files(make_files):
+    assert len(plan_batches(make_files(1, 1, 1), min_batches=4)) == 3
+    assert len(plan_batches(make_files(1, 1, 1, 1, 1), min_batches=4)) == 4
+
+
+def test_missing_file_counts_as_empty(tmp_path):
+    files = [("files", "gone.png", str(tmp_path / "gone.png"))]
+    assert plan_batches(files) == [files]
@@ -0,0 +1,64 @@
+# transcode.py
+
+import os
+import threading
+
+# Formats worth re-encoding. GIFs may be animated and SVGs are already small.
+TRANSCODABLE_EXTS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+# Images within the size cap and below this many bytes are left untouched.
+TRANSCODE_MIN_BYTES = 200 * 1024
+TRANSCODE_QUALITY = 80
+
+_writable_formats = None
+
+
+def _output_format(image):
+    from aqt.qt import QImageWriter
+
+    global _writable_formats
+    if _writable_formats is None:
+        _writable_formats = {bytes(f).decode().lower() for f in QImageWriter.supportedImageFormats()}
+    if "webp" in _writable_formats:
+        return "webp"
+    return "png" if image.hasAlphaChannel() else "jpg"
+
+
+def transcode_image(src_path, dest_dir, stem, max_dimension):
+    """Downscale an image to fit ``max_dimension`` and re-encode it compactly.
+
+    Writes ``<stem>.<format>`` into ``dest_dir`` and returns that file name, or
+    None when the image cannot be read or re-encoding would not make it
+    smaller. Safe to call from worker threads (QImage does not need the GUI
+    thread).
+    """
+    # Qt is imported here so modules that only need TRANSCODABLE_EXTS (like
+    # media.py) load without it.
+    from aqt.qt import QImage, Qt
+
+    image = QImage(src_path)
+    if image.isNull():
+        return None
+    src_size = os.path.getsize(src_path)
+    oversized = max(image.width(), image.height()) > max_dimension
+    if not oversized and src_size < TRANSCODE_MIN_BYTES:
+        return None
+    if oversized:
+        image = image.scaled(
+            max_dimension, max_dimension,
+            Qt.AspectRatioMode.KeepAspectRatio,
+            Qt.TransformationMode.SmoothTransformation,
+        )
+
+    fmt = _output_format(image)
+    name = f"{stem}.{fmt}"
+    dest_path = os.path.join(dest_dir, name)
+    tmp_path = f"{dest_path}.{threading.get_ident()}.tmp"
+    if not image.save(tmp_path, fmt.upper(), TRANSCODE_QUALITY):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    if os.path.getsize(tmp_path) >= src_size:
+        os.remove(tmp_path)
+        return None
+    os.replace(tmp_path, dest_path)
+    return name
@@ -3,7 +3,6 @@
 import os
 import uuid
 import webbrowser
-from heapq import nlargest
 from aqt import mw
 from aqt.qt import QAction
 from PyQt6.QtCore import Qt
@@ -11,21 +10,33 @@ from PyQt6.QtWidgets import (
     QApplication, QDialog, QVBoxLayout, QLabel, QComboBox, QDialogButtonBox,
     QPushButton, QMessageBox, QInputDialog
 )
-from PyQt6.QtCore import QTimer
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
 from PyQt6.QtWidgets import QApplication, QProgressDialog, QMessageBox, QInputDialog
-import requests
+from . import api
 import time
 from PyQt6.QtWidgets import QProgressDialog
 from PyQt6.QtWidgets import QHBoxLayout
 from aqt.qt import QApplication
 import base64
+from concurrent.futures import ThreadPoolExecutor
 import json
-from .cards import fetch_cards_by_criteria, get_cards
+from .cards import (
+    OUTPUT_PATH, batch_output_path, estimate_payload_tokens, fetch_cards_by_criteria,
+    fetch_cards_for_scopes, get_cards,
+)
+from .budget import BYTES_PER_TOKEN
+from .selection import REVLOG_MODES, SCORERS
 from .tag_input_widget import TagInputWidget
 from .style import MODERN_STYLE
 from .auth import get_cranky_token, run_cranky_login, CRANKY_CONFIG_KEY, ADDON_NAME
-from .config import API_BASE_FRONT, API_BASE_BACK, VIEWER_DIR
-from .utils import clean_media_folder
+from .config import API_BASE_FRONT, VIEWER_DIR, REVLOG_WINDOW_DAYS
+from .media import media_manifest
+from .upload import upload_media_files
+from .metrics import begin_run, current_run, stage, write_report
+from .progress import ExportCancelled, ExportProgress
+from .status import watch_scene_status
+from aqt.operations import QueryOp
+from .ndjson import iter_json_body, iter_ndjson
 from PyQt6.QtWidgets import QInputDialog
 from .auth import run_cranky_login, get_cranky_token, save_token
 
@@ -55,16 +66,6 @@ def get_jwt_expiry(jwt_token):
         return None
 
 
-def fetch_top_cards(card_ids, key, limit=LIMIT):
-    best_cards_by_note = {}
-    for cid in card_ids:
-        card = mw.col.get_card(cid)
-        note_id = card.nid
-        val = getattr(card, key, 0)
-        if note_id not in best_cards_by_note or val > getattr(best_cards_by_note[note_id], key, 0):
-            best_cards_by_note[note_id] = card
-    return nlargest(limit, best_cards_by_note.values(), key=lambda c: getattr(c, key, 0))
-
 def show_server_error(msg, details=None):
     txt = f"Cranky server error:\n\n{msg}"
     if details:
@@ -119,12 +120,15 @@ def launch_cranky_selector():
 
     layout.addWidget(QLabel("Card Selection Mode:"))
     mode_combo = QComboBox()
-    mode_combo.addItems(["Most Lapses", "Most Repetitions", "Random"])
+    mode_combo.addItems(list(SCORERS))
     layout.addWidget(mode_combo)
 
     card_count_label = QLabel("")
     layout.addWidget(card_count_label)
 
+    payload_estimate_label = QLabel("")
+    layout.addWidget(payload_estimate_label)
+
     button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
     layout.addWidget(button_box)
 
@@ -238,6 +242,8 @@ def launch_cranky_selector():
                 full_query = f"{base_query} is:review"
             else:
                 full_query = "is:review"
+        elif mode in REVLOG_MODES:  # Only cards answered within the review-log window
+            full_query = f"{base_query} rated:{REVLOG_WINDOW_DAYS}"
         else:  # Random mode, count all cards in deck/tag
             full_query = base_query
 
@@ -248,13 +254,52 @@ def launch_cranky_selector():
         except Exception as e:
             card_count_label.setText("Cards in scope: error")
             button_box.button(QDialogButtonBox.StandardButton.Ok).setEnabled(False)
+        payload_estimate_label.setText("Estimated payload: ...")
+        estimate_timer.start()
+
+    # The estimate ranks and renders the selection, so it waits for edits to
+    # settle and runs as a background op. Each run gets a generation number;
+    # results of runs started before the latest one are ignored.
+    estimate_generation = [0]
+
+    def update_payload_estimate():
+        estimate_generation[0] += 1
+        generation = estimate_generation[0]
+        deck, tags, mode = deck_combo.currentText(), tag_widget.get_tags(), mode_combo.currentText()
+
+        def on_estimated(tokens):
+            if generation != estimate_generation[0]:
+                return
+            kb = tokens * BYTES_PER_TOKEN / 1024
+            payload_estimate_label.setText(f"Estimated payload: ~{tokens} tokens ({kb:.0f} KB)")
+
+        def on_estimate_failed(err):
+            print(f"[Cranky] Payload estimate failed: {err}")
+            if generation == estimate_generation[0]:
+                payload_estimate_label.setText("Estimated payload: unavailable")
+
+        QueryOp(
+            parent=dialog,
+            op=lambda col: estimate_payload_tokens(deck, tags, mode, limit=LIMIT),
+            success=on_estimated,
+        ).failure(on_estimate_failed).run_in_background()
+
+    estimate_timer = QTimer(dialog)
+    estimate_timer.setSingleShot(True)
+    estimate_timer.setInterval(300)
+    estimate_timer.timeout.connect(update_payload_estimate)
 
     deck_combo.currentIndexChanged.connect(update_card_count)
     mode_combo.currentIndexChanged.connect(update_card_count)
     tag_widget.tagChanged.connect(update_card_count)
     update_card_count()  # initial count
 
-    if dialog.exec():
+    accepted = dialog.exec()
+    # A pending estimate must not run alongside the export started next, and
+    # one still running must not update the closed dialog.
+    estimate_timer.stop()
+    estimate_generation[0] += 1
+    if accepted:
         deck = deck_combo.currentText()
         selected_tags = tag_widget.get_tags()
         selection_mode = mode_combo.currentText()
@@ -264,6 +309,48 @@ def launch_cranky_selector():
 
 
 
+class ProgressSignals(QObject):
+    # Emitted from worker threads; Qt delivers it to the dialog on the main thread.
+    updated = pyqtSignal(str, int, int)
+
+
+def show_progress_dialog(label, progress):
+    """Show a modal progress dialog whose Cancel button cancels ``progress``.
+
+    ``progress`` updates from worker threads reach the dialog through a queued
+    Qt signal; a busy indicator is shown while the total is unknown.
+    """
+    dialog = QProgressDialog(label, "Cancel", 0, 0, mw)
+    dialog.setWindowTitle("Cranky Export")
+    dialog.setMinimumDuration(0)
+    dialog.setAutoClose(False)
+    dialog.setAutoReset(False)
+    dialog.setWindowModality(Qt.WindowModality.ApplicationModal)
+    dialog.canceled.connect(progress.cancel)
+
+    def update_gui(label, done, total):
+        if progress.cancelled or not dialog.isVisible():
+            return
+        dialog.setLabelText(label)
+        dialog.setMaximum(total)
+        dialog.setValue(done)
+
+    signals = ProgressSignals(dialog)
+    signals.updated.connect(update_gui, Qt.ConnectionType.QueuedConnection)
+    progress.on_update = signals.updated.emit
+    dialog.show()
+    return dialog
+
+
+def close_progress_dialog(dialog):
+    # Closing a QProgressDialog emits canceled(), which must not cancel a finished job.
+    try:
+        dialog.canceled.disconnect()
+    except TypeError:
+        pass  # already closed
+    dialog.close()
+
+
 def on_menu():
     result = launch_cranky_selector()
     if not result:
@@ -271,23 +358,220 @@ def on_menu():
         return
     deck, tags, mode = result
 
-    clean_media_folder()
     print(f"User selected: deck={deck}, tags={tags}, mode={mode}")
 
-    exported_cards = fetch_cards_by_criteria(deck, tags, mode, limit=25)
-    print(f"Exported {len(exported_cards)} cards.")
+    def run_export(progress):
+        exported_count = fetch_cards_by_criteria(deck, tags, mode, limit=LIMIT, progress=progress)
+        print(f"Exported {exported_count} cards.")
+        return [(deck, OUTPUT_PATH)] if exported_count else []
+
+    export_and_generate(run_export)
+
+
+def subdeck_names(deck):
+    """Names of the direct subdecks of ``deck``, or of the top-level decks for "all"."""
+    if deck in ("all", "-none-", "", None):
+        return sorted(
+            (d["name"] for d in mw.col.decks.all() if "::" not in d["name"]), key=str.casefold
+        )
+    did = mw.col.decks.id_for_name(deck)
+    if not did:
+        return []
+    return sorted((name for name, _ in mw.col.decks.children(did)), key=str.casefold)
+
+
+def on_batch_menu():
+    result = launch_cranky_selector()
+    if not result:
+        print("User cancelled selection.")
+        return
+    deck, tags, mode = result
 
-    if not exported_cards:
-        QMessageBox.warning(mw, "Export Failed", "No cards were exported.")
+    scopes = [(name, tags) for name in subdeck_names(deck)]
+    if not scopes:
+        QMessageBox.information(mw, "No Subdecks", f"{deck} has no subdecks to make scenes from.")
         return
+    print(f"User selected batch: deck={deck}, tags={tags}, mode={mode}, scopes={len(scopes)}")
+
+    def run_export(progress):
+        exported = fetch_cards_for_scopes(scopes, mode, limit=LIMIT, progress=progress)
+        print(f"Exported {sum(exported)} cards in {len(scopes)} scopes.")
+        return [
+            (name, batch_output_path(i))
+            for i, ((name, _), exported_count) in enumerate(zip(scopes, exported))
+            if exported_count
+        ]
+
+    export_and_generate(run_export)
+
+
+def export_and_generate(run_export):
+    """Run ``run_export(progress)`` in the background, ask for a theme meanwhile, then generate the scenes.
+
+    ``run_export`` returns a ``(deck name, payload path)`` pair for every
+    payload worth a scene; it runs as a collection op.
+    """
+    # Start the export right away on a background collection op, so selection,
+    # rendering and media staging run while the user is typing the theme.
+    progress = ExportProgress()
+    export_result = {}  # "payloads" or "error", set when the export op finishes
+    on_export_done = []  # continuation to run if the theme was confirmed first
+
+    def run_export_op(col):
+        with stage("export"):
+            return run_export(progress)
+
+    def on_exported(payloads):
+        write_report()
+        export_result["payloads"] = payloads
+        if on_export_done:
+            on_export_done.pop()()
+
+    def on_export_failed(err):
+        export_result["error"] = err
+        if on_export_done:
+            on_export_done.pop()()
+
+    begin_run()
+    QueryOp(parent=mw, op=run_export_op, success=on_exported).failure(on_export_failed).run_in_background()
 
     # Prompt for theme
     theme, ok = QInputDialog.getText(mw, "Memory Palace Theme", "Enter a theme for the memory palace:")
     print("Theme dialog result:", theme, ok)
     if not ok or not theme.strip():
+        progress.cancel()
         QMessageBox.warning(mw, "No Theme", "Operation cancelled: No theme provided.")
         return
 
+    def continue_with_theme():
+        err = export_result.get("error")
+        if isinstance(err, ExportCancelled):
+            print("[Cranky] Export cancelled.")
+            return
+        if err is not None:
+            show_server_error("Export Error", str(err))
+            return
+        if not export_result["payloads"]:
+            QMessageBox.warning(mw, "Export Failed", "No cards were exported.")
+            return
+        start_scene_generation(theme, export_result["payloads"])
+
+    if export_result:
+        continue_with_theme()
+        return
+
+    # The export is still running; wait for it behind a cancellable dialog.
+    progress_dialog = show_progress_dialog("Finishing export...", progress)
+
+    def after_export():
+        close_progress_dialog(progress_dialog)
+        continue_with_theme()
+
+    on_export_done.append(after_export)
+
+
+class SceneError(Exception):
+    """A scene generation step failed; ``title`` names the step for the error dialog."""
+
+    def __init__(self, title, message):
+        super().__init__(message)
+        self.title = title
+
+
+def scene_media_files(cards_path):
+    """Return ``("files", name, path)`` upload entries for the staged media the payload at ``cards_path`` uses."""
+    media_src = os.path.join(VIEWER_DIR, "media")
+    print(f"[Cranky] Media folder: {media_src}")
+    if not os.path.exists(media_src):
+        print("[Cranky] Media folder does not exist.")
+        return []
+    files = []
+    for fname in media_manifest(iter_ndjson(cards_path)):
+        path = os.path.join(media_src, fname)
+        if os.path.isfile(path):
+            files.append(("files", fname, path))
+        else:
+            print(f"[Cranky] Media file missing: {fname}")
+    return files
+
+
+def create_scene(theme, deck, cards_path, headers):
+    """Send the payload at ``cards_path`` to generate_scene and return the new session id."""
+    try:
+        with stage("scene_request"):
+            # Not retried: a second request would start a second scene.
+            resp = api.request(
+                "POST", "/v2/generate_scene", "generate_scene",
+                data=iter_json_body({"theme": theme, "deck_name": deck}, "cards", iter_ndjson(cards_path)),
+                headers={**headers, "Content-Type": "application/json"},
+            )
+        resp.raise_for_status()
+        session_id = resp.json()["session_id"]
+        print(f"[Cranky] Session ID received: {session_id}")
+        return session_id
+    except Exception as e:
+        raise SceneError("Scene Creation Error", str(e))
+
+
+def upload_scene_media(session_id, files, headers, progress):
+    # Media upload is not critical: failures are logged and the scene goes on.
+    if not files:
+        print("[Cranky] No media files to upload.")
+        return
+    try:
+        with stage("media_upload"):
+            uploaded, failed = upload_media_files(session_id, files, headers, progress)
+        print(f"✔️ Uploaded {uploaded} media files to server.")
+        if failed:
+            print(f"[Cranky] {len(failed)} media files could not be uploaded: {', '.join(failed)}")
+    except ExportCancelled:
+        raise
+    except Exception as e:
+        print(f"[Cranky] Media Upload Error: {e}")
+
+
+def wait_for_scene(session_id, headers, progress):
+    """Wait until the scene reports completion, by server push or adaptive polling."""
+    try:
+        watch_scene_status(session_id, headers, progress)
+    except ExportCancelled:
+        raise
+    except TimeoutError:
+        raise SceneError("Timeout", "Scene generation took too long.")
+    except Exception as e:
+        raise SceneError("Status Poll Error", str(e))
+
+
+def generate_scene(theme, deck, cards_path, headers, progress):
+    """Create a scene from the payload at ``cards_path``, upload its media and wait until it is ready.
+
+    Media can only be uploaded once the scene request has returned a session
+    id, so that request runs first. The upload then overlaps the status
+    watch: it runs on a worker thread while the server finishes the scene.
+
+    Runs on a background thread and returns the session id. Raises SceneError
+    if the scene cannot be created or polled, and ExportCancelled on cancel.
+    """
+    media_files = scene_media_files(cards_path)
+    session_id = create_scene(theme, deck, cards_path, headers)
+
+    progress.update("Generating scene and uploading media...")
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="cranky-scene") as pool:
+        upload = pool.submit(upload_scene_media, session_id, media_files, headers, progress)
+        try:
+            wait_for_scene(session_id, headers, progress)
+        except BaseException:
+            progress.cancel()  # stop the upload too; the scene is abandoned
+            raise
+        if not upload.done():
+            progress.update("Finishing media upload...")
+        # The dashboard shows the media, so it must be on the server first.
+        upload.result()
+    return session_id
+
+
+def start_scene_generation(theme, payloads):
+    """Generate one scene per ``(deck name, payload path)`` in ``payloads``, one after another, in the background."""
     jwt_token = get_cranky_token()
     if not jwt_token:
         QMessageBox.warning(mw, "Not logged in", "Please log in to Cranky first!")
@@ -296,124 +580,54 @@ def on_menu():
 
     # # Show progress dialog BEFORE background job, force repaint!
   
-    progress_dialog = QProgressDialog(
-        "Generating scene (this may take several minutes)...", None, 0, 0, mw
+    progress = ExportProgress()
+    progress_dialog = show_progress_dialog(
+        "Generating scene (this may take several minutes)...", progress
     )
-    progress_dialog.setWindowTitle("Cranky Export")
-    progress_dialog.setCancelButton(None)
-    progress_dialog.setMinimumDuration(0)
-    progress_dialog.setWindowModality(Qt.WindowModality.ApplicationModal)
-    progress_dialog.show()
-
-    for _ in range(5):
-        QApplication.processEvents()
-        import time
-        time.sleep(0.01)
-
-    def background_job(progress):
+
+    def background_job():
         print("[Cranky] background_job started!")
-        session_id = None
         try:
-
-            if not exported_cards:
-                mw.taskman.run_on_main(lambda: QMessageBox.warning(mw, "Export Failed", "No cards were exported."))
-                progress_dialog.cancel()
-                return
-
-            # Scene creation
-            try:
-                resp = requests.post(
-                    f"{API_BASE_BACK}/v2/generate_scene",
-                    json={"theme": theme, "cards": exported_cards, "deck_name": deck},
-                    headers=headers, timeout=1000
-                )
-                resp.raise_for_status()
-                session_id = resp.json()["session_id"]
-                print(f"[Cranky] Session ID received: {session_id}")
-            except Exception as e:
-                mw.taskman.run_on_main(lambda: show_server_error("Scene Creation Error", str(e)))
-                progress_dialog.cancel()
-                return
-
-            # Media upload (not critical)
-            try:
-                media_src = os.path.join(VIEWER_DIR, "media")
-                print(f"[Cranky] Media folder: {media_src}")
-                if os.path.exists(media_src):
-                    files = []
-                    for fname in os.listdir(media_src):
-                        path = os.path.join(media_src, fname)
-                        try:
-                            f = open(path, 'rb')
-                            files.append(('files', (fname, f)))
-                            print(f"[Cranky] Prepared for upload: {fname}")
-                        except Exception as e:
-                            print(f"[Cranky] Error opening file {fname}: {e}")
-                    if files:
-                        upload_url = f"{API_BASE_BACK}/upload_media/{session_id}"
-                        try:
-                            resp = requests.post(upload_url, files=files, headers=headers)
-                            if resp.status_code == 200:
-                                print(f"✔️ Uploaded {len(files)} media files to server.")
-                            else:
-                                print(f"[Cranky] Media upload failed: {resp.status_code} {resp.text}")
-                            print(f"[Cranky] Upload response: {resp.status_code} {resp.text}")
-                        finally:
-                            for _, (_, fh) in files:
-                                try:
-                                    fh.close()
-                                except:
-                                    pass
-                    else:
-                        print("[Cranky] No media files to upload.")
-                else:
-                    print("[Cranky] Media folder does not exist.")
-            except Exception as e:
-                print(f"[Cranky] Media Upload Error: {e}")
-                # No popup or abort; continue
-
-            # Poll status until complete (no progress label/statusbar updates)
-            print(f"[Cranky] Begin polling status for session {session_id}")
-            max_tries = 1000
-            for i in range(max_tries):
-                time.sleep(2)
-                QApplication.processEvents()
-                try:
-                    poll_resp = requests.get(f"{API_BASE_BACK}/v2/status/{session_id}", headers=headers, timeout=30)
-                    if poll_resp.status_code != 200:
-                        print(f"[Cranky] Polling non-200 status: {poll_resp.status_code} {poll_resp.text}")
-                        continue  # Keep polling
-                    status = poll_resp.json().get("status", "pending")
-                    print(f"[Cranky] Status: {status}")
-                    if "complete" in status.lower():
-                        print("[Cranky] Polling complete")
-                        break
-                except Exception as e:
-                    mw.taskman.run_on_main(lambda: show_server_error("Status Poll Error", str(e)))
-                    progress_dialog.cancel()
-                    return
-            else:
-                mw.taskman.run_on_main(lambda: show_server_error("Timeout", "Scene generation took too long."))
-                progress_dialog.cancel()
-                return
+            for i, (deck, cards_path) in enumerate(payloads, 1):
+                if len(payloads) > 1:
+                    progress.update(f"Scene {i} of {len(payloads)}: {deck}")
+                generate_scene(theme, deck, cards_path, headers, progress)
 
             #  Workflow complete - open dashboard in browser!
             token = get_cranky_token()
             url = f"{API_BASE_FRONT}/?token={token}"
+            write_report()
+            summary = current_run().summary()
+            message = "Your Cranky Dashboard was opened in your browser."
+            if len(payloads) > 1:
+                message = f"{len(payloads)} scenes were generated. {message}"
             def finish_gui():
-                progress_dialog.cancel()
+                close_progress_dialog(progress_dialog)
                 import webbrowser
                 webbrowser.open(url)
-                QMessageBox.information(mw, "Workflow Complete", "Your Cranky Dashboard was opened in your browser.")
+                QMessageBox.information(
+                    mw, "Workflow Complete",
+                    f"{message}\n\n{summary}",
+                )
             mw.taskman.run_on_main(finish_gui)
 
+        except ExportCancelled:
+            print("[Cranky] Scene generation cancelled.")
+            mw.taskman.run_on_main(lambda: close_progress_dialog(progress_dialog))
+        except SceneError as e:
+            title, message = e.title, str(e)
+            mw.taskman.run_on_main(lambda: show_server_error(title, message))
+            mw.taskman.run_on_main(lambda: close_progress_dialog(progress_dialog))
         except Exception as e:
             print("[Cranky] Exception in background_job:", e)
-            mw.taskman.run_on_main(lambda: show_server_error("Workflow error", str(e)))
-            progress_dialog.cancel()
-
-    # Start background job with a tiny delay so Qt can finish window setup/painting
-    QTimer.singleShot(100, lambda: mw.taskman.run_in_background("Cranky Export", background_job))
+            message = str(e)
+            mw.taskman.run_on_main(lambda: show_server_error("Workflow error", message))
+            mw.taskman.run_on_main(lambda: close_progress_dialog(progress_dialog))
+
+    # Start background job with a tiny delay so Qt can finish window setup/painting.
+    # The job only talks to the backend, so it must not hold the collection:
+    # it can run for the better part of an hour.
+    QTimer.singleShot(100, lambda: mw.taskman.run_in_background(background_job, uses_collection=False))
     
 
 # Register actions
@@ -421,4 +635,8 @@ action = QAction("Cranky Memory Palace", mw)
 action.triggered.connect(on_menu)
 mw.form.menuTools.addAction(action)
 
+batch_action = QAction("Cranky Memory Palace: One Scene per Subdeck", mw)
+batch_action.triggered.connect(on_batch_menu)
+mw.form.menuTools.addAction(batch_action)
+
 #add_cranky_login_menu()  # Login QAction already handled here
@@ -0,0 +1,100 @@
+# upload.py
+
+import heapq
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from . import api
+from .multipart import MultipartFiles
+from .progress import ExportCancelled
+
+# Media is sent in batches of roughly equal size over a few connections, so
+# one slow or failed request only costs its own batch.
+UPLOAD_WORKERS = 4
+UPLOAD_BATCH_BYTES = 8 * 1024 * 1024
+UPLOAD_BATCH_FILES = 50
+
+
+def plan_batches(files, max_bytes=UPLOAD_BATCH_BYTES, max_files=UPLOAD_BATCH_FILES, min_batches=1):
+    """Split ``files`` (``(field, filename, path)`` tuples) into size-balanced batches.
+
+    Uses as few batches as keep each under ``max_bytes`` and ``max_files``
+    (a single larger file still gets a batch of its own), but at least
+    ``min_batches`` when there are enough files. Largest files are placed
+    first, each into the lightest batch with room, and every batch keeps the
+    original file order.
+    """
+    if not files:
+        return []
+    sizes = []
+    for _, _, path in files:
+        try:
+            sizes.append(os.path.getsize(path))
+        except OSError:
+            sizes.append(0)
+    count = max(
+        math.ceil(sum(sizes) / max_bytes),
+        math.ceil(len(files) / max_files),
+        min(min_batches, len(files)),
+    )
+    heap = [(0, i) for i in range(count)]  # (bytes, batch index)
+    members = [[] for _ in range(count)]
+    for idx in sorted(range(len(files)), key=lambda i: -sizes[i]):
+        full = []
+        size, b = heapq.heappop(heap)
+        while len(members[b]) >= max_files:
+            full.append((size, b))
+            size, b = heapq.heappop(heap)
+        members[b].append(idx)
+        heapq.heappush(heap, (size + sizes[idx], b))
+        for entry in full:
+            heapq.heappush(heap, entry)
+    return [[files[i] for i in sorted(batch)] for batch in members if batch]
+
+
+def upload_media_files(session_id, files, headers, progress=None, max_workers=UPLOAD_WORKERS):
+    """Upload ``files`` to the scene ``session_id`` in parallel batches.
+
+    Each batch is retried on its own by api.request. Returns
+    ``(uploaded, failed)``: the number of files in batches the server
+    accepted, and the filenames of batches that still failed.
+    """
+    batches = plan_batches(files, min_batches=max_workers)
+    uploaded = 0
+    failed = []
+
+    def send(batch):
+        if progress:
+            progress.check()
+        body = MultipartFiles(batch)
+        return api.request(
+            "POST", f"/upload_media/{session_id}", "upload_media",
+            # Uploading the same files to a session again replaces them.
+            idempotent=True, progress=progress, data=body,
+            headers={**headers, "Content-Type": body.content_type},
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cranky-upload") as pool:
+        futures = {pool.submit(send, batch): batch for batch in batches}
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                batch = futures[future]
+                try:
+                    resp = future.result()
+                except ExportCancelled:
+                    raise
+                except Exception as e:
+                    print(f"[Cranky] Media batch of {len(batch)} files failed: {e}")
+                    failed.extend(name for _, name, _ in batch)
+                else:
+                    if resp.status_code == 200:
+                        uploaded += len(batch)
+                    else:
+                        print(f"[Cranky] Media batch of {len(batch)} files failed: {resp.status_code} {resp.text}")
+                        failed.extend(name for _, name, _ in batch)
+                if progress:
+                    progress.update(f"Uploading media ({done}/{len(batches)} batches)...", done, len(batches))
+        except BaseException:
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+    return uploaded, failed
@@ -1,20 +1,33 @@
 # utils.py
 
+import json
 import os
-import shutil
-from .config import VIEWER_DIR
 
-def clean_media_folder():
-    media_dir = os.path.join(VIEWER_DIR, "media")
-    print("Cleaning media folder:", media_dir)
-    print("CWD:", os.getcwd())
-    if os.path.exists(media_dir):
-        for fname in os.listdir(media_dir):
-            fpath = os.path.join(media_dir, fname)
-            try:
-                if os.path.isfile(fpath):
-                    os.remove(fpath)
-                elif os.path.isdir(fpath):
-                    shutil.rmtree(fpath)
-            except Exception as e:
-                print(f"⚠️ Failed to delete {fpath}: {e}")
+
+def load_json_cache(path, description):
+    """Return the JSON document at ``path``, or None if it is missing or unreadable."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[Cranky] Ignoring unreadable {description}: {e}")
+        return None
+
+
+def atomic_write_json(path, data, description):
+    """Write ``data`` to ``path`` through a temporary file, so readers never see a partial file.
+
+    Returns True on success; failures are reported and otherwise ignored, as
+    everything written this way is a cache.
+    """
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        print(f"⚠️ Could not save {description}: {e}")
+        return False